@@ -0,0 +1,398 @@
+import argparse
+import contextlib
+import json
+import logging
+import platform
+import random
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from crawler.robots_parser import RobotsRules  # noqa: E402
+from crawler.spider import WebSpider  # noqa: E402
+from parser.content_extractor import ContentExtractor  # noqa: E402
+from parser.dom import parse_html  # noqa: E402
+from parser.html_to_md import HTML2Markdown  # noqa: E402
+from parser.lxml_to_md import LxmlMarkdown  # noqa: E402
+from utils.logger import FORMAT, Logger, configure_logging  # noqa: E402
+from parser.resource_handler import ResourceHandler  # noqa: E402
+from server import serve_site  # noqa: E402
+from synthetic_site import generate_site  # noqa: E402
+from web_to_markdown import WebToMarkdown  # noqa: E402
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process and its finished children"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(max(usage, children) / scale, 1)
+
+
+# html2text's markers for code blocks, which the lxml engine writes as fences
+_CODE_MARKERS = re.compile(r"\[/?code\]")
+_LINK_TARGET = re.compile(r"\]\(([^)\s]+)")
+_WORD = re.compile(r"[^\W_]+")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(func, items, repeat=1):
+    """Run func over items and report throughput, latency and traced peak memory"""
+    timings = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            t0 = time.perf_counter()
+            func(item)
+            timings.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "items": len(timings),
+        "seconds": round(elapsed, 4),
+        "items_per_sec": round(len(timings) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(statistics.mean(timings) * 1000, 3),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1] * 1000, 3),
+        "max_ms": round(timings[-1] * 1000, 3),
+        "traced_peak_mb": round(peak / (1024 * 1024), 2),
+    }
+
+
+def bench_stages(site_dir, paths, base_url, args):
+    """Per-stage throughput on the generated pages"""
+    pages = [(site_dir / path).read_text(encoding="utf-8") for path in paths]
+    cleaned = [ContentExtractor.clean_html(html) for html in pages]
+    main_contents = [ContentExtractor.get_main_content(tree) for tree in cleaned]
+    converter = HTML2Markdown()
+
+    results = {
+        "clean_html": measure(ContentExtractor.clean_html, pages, args.repeat),
+        # readability and title extraction read a tree; re-clean so each run starts fresh
+        "get_main_content": measure(
+            lambda html: ContentExtractor.get_main_content(ContentExtractor.clean_html(html)),
+            pages,
+            args.repeat,
+        ),
+        "html2markdown_convert": measure(converter.convert, main_contents, args.repeat),
+        "lxml_markdown_convert": measure(LxmlMarkdown().convert, main_contents, args.repeat),
+    }
+    results["engine_equivalence"] = check_engines(paths, main_contents)
+    results.update(bench_robots(args))
+    results.update(bench_links(base_url, args))
+    results.update(bench_logging(args))
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        handler = ResourceHandler(out_dir)
+        images = sorted(p.name for p in (site_dir / "img").iterdir())
+        results["download_image"] = measure(
+            handler.download_image, [f"{base_url}/img/{name}" for name in images]
+        )
+        handler.close()
+
+    spider = WebSpider(
+        f"{base_url}/docs/index.html", args.max_depth, 0, None, args.concurrency, args.concurrency
+    )
+    start = time.perf_counter()
+    crawled = sum(1 for _ in spider.crawl())
+    elapsed = time.perf_counter() - start
+    results["spider_crawl"] = {
+        "items": crawled,
+        "seconds": round(elapsed, 4),
+        "items_per_sec": round(crawled / elapsed, 2) if elapsed else None,
+    }
+    return results
+
+
+# A large site's robots.txt: plain prefixes, wildcards and end anchors
+_BENCH_ROBOTS = "User-agent: *\n" + "".join(
+    f"Disallow: /section{i}/private/\nAllow: /section{i}/private/public/\n" for i in range(40)
+) + "".join(
+    f"Disallow: /*{ext}$\n" for ext in (".pdf", ".zip", ".json", ".xml", ".csv")
+) + "Disallow: /*?sessionid=\nDisallow: /search\nDisallow: /*/print/\nAllow: /search/help\n"
+
+
+def _robots_pages(pages=5, links=10000, seed=0):
+    """Pages of 10k links each, mixing allowed and disallowed URLs"""
+    rng = random.Random(seed)
+    tails = ["", "private/", "private/public/", "print/", "page.pdf", "data.json", "?sessionid=1"]
+    return [
+        [
+            f"https://example.com/section{rng.randrange(60)}/{tail}{rng.randrange(1000)}.html"
+            if not tail.startswith("?") else f"https://example.com/docs/{rng.randrange(1000)}{tail}"
+            for tail in (rng.choice(tails) for _ in range(links))
+        ]
+        for _ in range(pages)
+    ]
+
+
+def bench_robots(args):
+    """robots.txt checks for every link of 10k-link pages, compiled rules vs urllib"""
+    pages = _robots_pages()
+    rules = RobotsRules.parse(_BENCH_ROBOTS, "WebToMarkdown Bot")
+    parser = RobotFileParser()
+    parser.parse(_BENCH_ROBOTS.splitlines())
+    return {
+        "robots_can_fetch": measure(
+            lambda links: [rules.allowed(link) for link in links], pages, args.repeat
+        ),
+        "robots_can_fetch_urllib": measure(
+            lambda links: [parser.can_fetch("WebToMarkdown Bot", link) for link in links],
+            pages,
+            args.repeat,
+        ),
+    }
+
+
+def _link_pages(base_url, pages=20, links=2000, seed=0):
+    """Navigation-heavy pages: relative, absolute, duplicate, external and skipped links"""
+    rng = random.Random(seed)
+    kinds = [
+        lambda n: f"page{n}.html",
+        lambda n: f"../docs/page{n}.html#part",
+        lambda n: f"/docs/page{n}.html?utm_source=nav",
+        lambda n: f"{base_url}/docs/page{n}.html",
+        lambda n: f"./guide/{n}/index.html",
+        lambda n: f"https://elsewhere.example/{n}",
+        lambda n: f"/files/report{n}.PDF",
+        lambda n: "javascript:void(0)",
+        lambda n: f"#section{n}",
+    ]
+    result = []
+    for i in range(pages):
+        anchors = "".join(
+            f'<a href="{rng.choice(kinds)(rng.randrange(links // 2))}">link</a>' for _ in range(links)
+        )
+        result.append((f"{base_url}/docs/section{i}/page.html", parse_html(f"<html><body>{anchors}</body></html>")))
+    return result
+
+
+def _legacy_extract_links(spider, tree, current_url):
+    """The per-link extraction the batch path replaced, kept as a baseline"""
+    links = []
+    for link in tree.iter("a"):
+        href = (link.get("href") or "").strip()
+        if not href or href.startswith("javascript:") or href.startswith("#"):
+            continue
+        url = spider.canonicalizer.canonicalize(urljoin(current_url, href))
+        parsed = urlparse(url)
+        if not parsed.scheme or not parsed.netloc or spider.frontier.seen(url):
+            continue
+        if parsed.netloc != spider.domain:
+            continue
+        if any(parsed.path.lower().endswith(ext) for ext in spider.skip_extensions):
+            continue
+        if spider.robots_parser.can_fetch(url):
+            links.append(url)
+    return links
+
+
+def bench_links(base_url, args):
+    """Link extraction on 2,000-link pages, batch path vs the per-link baseline"""
+    pages = _link_pages(base_url)
+    spider = WebSpider(f"{base_url}/docs/index.html", 1, 0)
+    legacy = [_legacy_extract_links(spider, tree, url) for url, tree in pages]
+    batch = [spider._extract_links(tree, url) for url, tree in pages]
+    return {
+        "extract_links": measure(lambda page: spider._extract_links(page[1], page[0]), pages, args.repeat),
+        "extract_links_legacy": measure(
+            lambda page: _legacy_extract_links(spider, page[1], page[0]), pages, args.repeat
+        ),
+        # The batch path dedupes within a page; the links kept must be the same
+        "extract_links_equivalent": all(set(a) == set(b) for a, b in zip(legacy, batch)),
+    }
+
+
+def _legacy_logger(stream):
+    """A synchronous handler and eager f-strings, as every Logger used to set up"""
+    logger = logging.getLogger("bench.legacy")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    logger.addHandler(handler)
+    return logger, handler
+
+
+def bench_logging(args):
+    """A per-URL INFO line for 1,000 URLs, queued and rate-limited vs written synchronously"""
+    pages = [[f"https://example.com/docs/page{n}.html" for n in range(i, i + 1000)] for i in range(0, 5000, 1000)]
+    results = {}
+    logging.disable(logging.NOTSET)
+    try:
+        # Handlers bind sys.stderr when configured, so everything goes to a file
+        with tempfile.TemporaryFile("w") as sink, contextlib.redirect_stderr(sink):
+            legacy, handler = _legacy_logger(sink)
+            results["log_per_url_legacy"] = measure(
+                lambda urls: [legacy.info(f"Crawling {url} (depth {1})") for url in urls], pages, args.repeat
+            )
+            legacy.removeHandler(handler)
+
+            for name, limit in (("log_per_url", 10), ("log_per_url_unlimited", 0)):
+                configure_logging("INFO", rate_limit=limit)
+                logger = Logger("bench.queue")
+                results[name] = measure(
+                    lambda urls: [logger.info("Crawling %s (depth %s)", url, 1) for url in urls],
+                    pages,
+                    args.repeat,
+                )
+                # Reconfiguring waits for the listener to drain the queue
+                configure_logging("INFO", rate_limit=limit)
+    finally:
+        configure_logging()
+        logging.disable(logging.CRITICAL)
+    return results
+
+
+def _markdown_signature(markdown):
+    """Words and link targets of a page, ignoring how each engine spells the markup"""
+    markdown = _CODE_MARKERS.sub("", markdown)
+    return _WORD.findall(markdown), _LINK_TARGET.findall(markdown)
+
+
+def check_engines(paths, main_contents):
+    """Compare the lxml engine's output with html2text's, page by page"""
+    reference, candidate = HTML2Markdown(), LxmlMarkdown()
+    mismatches = [
+        path
+        for path, html in zip(paths, main_contents)
+        if _markdown_signature(reference.convert(html)) != _markdown_signature(candidate.convert(html))
+    ]
+    return {
+        "pages": len(main_contents),
+        "equivalent": len(main_contents) - len(mismatches),
+        "mismatches": mismatches[:20],
+    }
+
+
+def bench_end_to_end(base_url, args):
+    """Full crawl, conversion and write through WebToMarkdown.run"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        out_dir = Path(work_dir) / "output"
+        config = {
+            "target_url": f"{base_url}/docs/",
+            "output_dir": str(out_dir),
+            "max_depth": args.max_depth,
+            "delay": 0,
+            "concurrency": args.concurrency,
+            "per_host_concurrency": args.concurrency,
+            "conversion_workers": args.workers,
+            "markdown_engine": args.engine,
+            "cache_db": None,
+            "checkpoint_path": None,
+        }
+        config_path = Path(work_dir) / "bench.yaml"
+        config_path.write_text(yaml.safe_dump(config), encoding="utf-8")
+
+        app = WebToMarkdown(str(config_path))
+        start = time.perf_counter()
+        app.run()
+        elapsed = time.perf_counter() - start
+
+        written = sum(1 for _ in out_dir.rglob("*.md"))
+        return {
+            "pages": written,
+            "seconds": round(elapsed, 4),
+            "pages_per_sec": round(written / elapsed, 2) if elapsed else None,
+        }
+
+
+def compare(baseline_path, results):
+    """Print throughput changes against an earlier results file"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    print(f"Compared with {baseline_path} ({baseline.get('commit')})")
+    rows = [("end_to_end", "pages_per_sec")] + [
+        (f"stages.{name}", "items_per_sec") for name in results["stages"]
+    ]
+    for key, metric in rows:
+        old, new = baseline, results
+        for part in key.split("."):
+            old = (old or {}).get(part)
+            new = (new or {}).get(part)
+        before, after = (old or {}).get(metric), (new or {}).get(metric)
+        if before and after:
+            print(f"  {key:32} {before:>10} -> {after:>10} ({(after / before - 1) * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline WebToMarkdown benchmarks")
+    parser.add_argument("--pages", type=int, default=200, help="number of generated pages")
+    parser.add_argument("--fanout", type=int, default=8, help="navigation links per page")
+    parser.add_argument("--images", type=int, default=2, help="images per page")
+    parser.add_argument("--no-pathological", action="store_true", help="skip stress pages")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every response"
+    )
+    parser.add_argument("--max-depth", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="conversion workers (default: all cores)"
+    )
+    parser.add_argument("--engine", default="html2text", help="markdown_engine for the end-to-end run")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the pages per stage")
+    parser.add_argument("--skip-e2e", action="store_true", help="only run per-stage benchmarks")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    # Benchmarks measure work, not terminal output
+    logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as site_dir:
+        site_dir = Path(site_dir)
+        paths = generate_site(
+            site_dir, args.pages, args.fanout, args.images, not args.no_pathological
+        )
+        with serve_site(site_dir, args.latency) as base_url:
+            results = {
+                "commit": _git_commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "params": vars(args),
+                "stages": bench_stages(site_dir, paths, base_url, args),
+            }
+            if not args.skip_e2e:
+                results["end_to_end"] = bench_end_to_end(base_url, args)
+
+    results["peak_rss_mb"] = _peak_rss_mb()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
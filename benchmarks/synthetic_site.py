@@ -0,0 +1,117 @@
+import base64
+import random
+from pathlib import Path
+
+# 1x1 transparent PNG
+PIXEL_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+)
+
+WORDS = (
+    "api component render reactive state props event handler option value "
+    "returns instance directive template compiler runtime module plugin config "
+    "lifecycle hook watcher computed effect scope slot emit inject provide"
+).split()
+
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _page(rng, index, pages, fanout, images):
+    links = "".join(
+        f'<li><a href="/docs/page{rng.randrange(pages)}.html">Page link</a></li>'
+        for _ in range(fanout)
+    )
+    paragraphs = "".join(
+        f"<p>{_sentence(rng, 20)} <a href=\"/docs/page{rng.randrange(pages)}.html#part\">"
+        f"<code>{rng.choice(WORDS)}()</code></a> {_sentence(rng)}</p>"
+        for _ in range(6)
+    )
+    rows = "".join(
+        f"<tr><td><code>{rng.choice(WORDS)}</code></td><td>{_sentence(rng, 6)}</td></tr>"
+        for _ in range(8)
+    )
+    pictures = "".join(
+        f'<img src="/img/figure{rng.randrange(images * 4 or 1)}.png" alt="figure">'
+        for _ in range(images)
+    )
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Page {index}</title>
+<style>.x{{color:red}}</style><script>window.analytics = {{}};</script></head>
+<body>
+<nav><ul>{links}</ul></nav>
+<main><article>
+<h1>Page {index}</h1>
+{paragraphs}
+<h2>Options</h2>
+<table><thead><tr><th>Name</th><th>Description</th></tr></thead><tbody>{rows}</tbody></table>
+<h2>Example</h2>
+<pre><code>import {{ ref }} from 'vue'
+const count = ref({index})
+function increment() {{
+  count.value++
+}}</code></pre>
+<ul><li>{_sentence(rng)}</li><li>{_sentence(rng)}<ul><li>{_sentence(rng)}</li></ul></li></ul>
+{pictures}
+</article></main>
+<footer><p>Footer text</p></footer>
+</body></html>"""
+
+
+def _pathological_pages(rng, pages):
+    """Pages that stress link extraction, tables, nesting and code blocks"""
+    nav = "".join(f'<a href="/docs/page{i % pages}.html#s{i}">L{i}</a>' for i in range(3000))
+    yield "links.html", (
+        f"<html><head><title>Links</title></head>"
+        f"<body><div>{nav}</div><p>{_sentence(rng)}</p></body></html>"
+    )
+
+    rows = "".join(
+        f"<tr>{''.join(f'<td>{rng.choice(WORDS)}</td>' for _ in range(10))}</tr>"
+        for _ in range(2000)
+    )
+    yield "table.html", (
+        f"<html><head><title>Table</title></head><body><table>{rows}</table></body></html>"
+    )
+
+    nested = "<div>" * 400 + f"<p>{_sentence(rng)}</p>" + "</div>" * 400
+    yield "nested.html", f"<html><head><title>Nested</title></head><body>{nested}</body></html>"
+
+    code = "\n".join(f"line_{i} = compute({i})  # {_sentence(rng, 5)}" for i in range(5000))
+    yield "code.html", (
+        f"<html><head><title>Code</title></head>"
+        f"<body><h1>Code</h1><pre><code>{code}</code></pre></body></html>"
+    )
+
+
+def generate_site(root, pages=200, fanout=8, images=2, pathological=True, seed=0):
+    """Write the site under root and return the list of page paths"""
+    rng = random.Random(seed)
+    root = Path(root)
+    (root / "docs").mkdir(parents=True, exist_ok=True)
+    (root / "img").mkdir(exist_ok=True)
+
+    paths = []
+    for i in range(pages):
+        path = f"docs/page{i}.html"
+        (root / path).write_text(_page(rng, i, pages, fanout, images), encoding="utf-8")
+        paths.append(path)
+
+    if pathological:
+        for name, html in _pathological_pages(rng, pages):
+            path = f"docs/{name}"
+            (root / path).write_text(html, encoding="utf-8")
+            paths.append(path)
+
+    # Distinct bytes per image so the asset store cannot collapse them
+    for i in range(images * 4 or 1):
+        (root / "img" / f"figure{i}.png").write_bytes(PIXEL_PNG + i.to_bytes(4, "big"))
+
+    index_links = "".join(f'<li><a href="/{path}">{path}</a></li>' for path in paths)
+    (root / "docs" / "index.html").write_text(
+        f"<html><head><title>Docs</title></head><body><ul>{index_links}</ul></body></html>",
+        encoding="utf-8",
+    )
+    (root / "robots.txt").write_text("User-agent: *\nDisallow: /private/\n", encoding="utf-8")
+    return paths
@@ -9,8 +9,11 @@ def _load_config(path):
 
 
 class ConfigLoader:
-    def __init__(self, config_path="config/default.yaml"):
+    def __init__(self, config_path="config/default.yaml", overrides=None):
         self.config = _load_config(config_path)
+        if overrides:
+            # Per-site settings of a batch take precedence over the file
+            self.config = {**self.config, **overrides}
 
     def get(self, key, default=None):
         return self.config.get(key, default)
@@ -0,0 +1,140 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from parser.dom import decode_html
+from utils.logger import Logger
+
+try:
+    import zstandard
+except ImportError:  # Optional: bodies are zlib-compressed without it
+    zstandard = None
+
+# Body compression levels; zstd 10 costs a few ms per page
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 6
+
+
+class CaptureStore:
+    """Fetched HTML responses kept locally so pages can be re-converted offline
+
+    ``pages(url, hash, status, headers, charset, fetched_at)`` holds the last
+    200 response of every URL and ``bodies(hash, codec, data)`` its body,
+    compressed with zstd when the ``zstandard`` package is installed and
+    zlib otherwise. Bodies are keyed by their SHA-256, so identical pages
+    are stored once. Every row records its codec, so stores stay readable
+    whichever codec wrote them.
+    """
+
+    def __init__(self, path):
+        self.logger = Logger(__name__)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Responses are recorded from several threads; zstd contexts are per thread
+        self._local = threading.local()
+        # Every write commits at once, cheap in WAL mode, so the write lock
+        # is never held between pages
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                hash TEXT,
+                status INTEGER,
+                headers TEXT,
+                charset TEXT,
+                fetched_at REAL
+            )"""
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS bodies (hash TEXT PRIMARY KEY, codec TEXT, data BLOB)")
+        self._db.commit()
+
+    def record(self, url, status, headers, charset, body, content_hash):
+        """Store a fetched response, compressing its body unless already stored"""
+        with self._lock:
+            stored = self._db.execute("SELECT 1 FROM bodies WHERE hash = ?", (content_hash,)).fetchone()
+        if not stored:
+            codec, data = self._compress(body)
+
+        with self._lock:
+            if not stored:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO bodies (hash, codec, data) VALUES (?, ?, ?)",
+                    (content_hash, codec, sqlite3.Binary(data)),
+                )
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages (url, hash, status, headers, charset, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, content_hash, status, json.dumps(dict(headers)), charset, time.time()),
+            )
+            self._db.commit()
+
+    def replay(self):
+        """Yield (url, html) for every captured page, in capture order"""
+        with self._lock:
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT pages.url, pages.charset, bodies.codec, bodies.data FROM pages "
+                "JOIN bodies ON bodies.hash = pages.hash ORDER BY pages.rowid"
+            )
+            batch = rows.fetchmany(256)
+        while batch:
+            for url, charset, codec, data in batch:
+                try:
+                    yield url, decode_html(self._decompress(codec, data), charset)
+                except Exception as e:
+                    self.logger.error("Error reading the capture of %s: %s", url, e)
+            with self._lock:
+                batch = rows.fetchmany(256)
+
+    def remove(self, url):
+        """Forget a page that is no longer on the site; its body goes once unused"""
+        with self._lock:
+            row = self._db.execute("SELECT hash FROM pages WHERE url = ?", (url,)).fetchone()
+            if row:
+                self._db.execute("DELETE FROM pages WHERE url = ?", (url,))
+                self._db.execute(
+                    "DELETE FROM bodies WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM pages WHERE hash = ?)",
+                    (row[0], row[0]),
+                )
+                self._db.commit()
+
+    def has(self, url):
+        """Whether a page is captured"""
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM pages WHERE url = ?", (url,)).fetchone() is not None
+
+    def count(self):
+        """Number of captured pages"""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self):
+        """Commit pending writes and close the database"""
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def _compress(self, body):
+        if zstandard is None:
+            return "zlib", zlib.compress(body, ZLIB_LEVEL)
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return "zstd", compressor.compress(body)
+
+    @staticmethod
+    def _decompress(codec, data):
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("captured with zstd; install zstandard to read it")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+from utils.logger import Logger
+
+
+class CrawlJournal:
+    """Append-only journal of crawl progress used to resume interrupted crawls
+
+    Each line is one tab-separated event:
+
+        Q <depth> <url>   URL was added to the frontier
+        D <url>           URL needs no further work (written or skipped)
+        A <path> <url>    asset was downloaded to path
+
+    Events are buffered in memory and written out at most every
+    ``flush_interval`` seconds, so recording is a list append on the hot path.
+    """
+
+    def __init__(self, path, flush_interval=5, resume=False):
+        self.logger = Logger(__name__)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+        # Called before buffered events are written, so that whatever they
+        # describe (e.g. pages in a batching output sink) is durable first
+        self.before_flush = None
+
+        # State recovered from a previous run
+        self.queued = {}
+        self.done = set()
+        self.assets = {}
+        self.resumed = False
+
+        if resume and self.path.exists():
+            self._load()
+            self._compact()
+            self.resumed = True
+            self.logger.info(
+                "Resuming from %s: %s done, %s pending, %s assets",
+                self.path, len(self.done), len(self.pending()), len(self.assets)
+            )
+
+        self._file = open(self.path, "a" if self.resumed else "w", encoding="utf-8")
+
+    def pending(self):
+        """Queued (url, depth) pairs that were not finished, in queue order"""
+        return [(url, depth) for url, depth in self.queued.items() if url not in self.done]
+
+    def record_queued(self, url, depth):
+        self._append(f"Q\t{depth}\t{url}\n")
+
+    def record_done(self, url):
+        self._append(f"D\t{url}\n")
+
+    def record_asset(self, url, path):
+        self._append(f"A\t{path}\t{url}\n")
+
+    def flush(self):
+        """Write buffered events to disk"""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Flush remaining events and close the journal"""
+        with self._lock:
+            if self._file is not None:
+                self._flush_locked()
+                self._file.close()
+                self._file = None
+
+    def _append(self, line):
+        with self._lock:
+            self._buffer.append(line)
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer or self._file is None:
+            return
+        if self.before_flush is not None:
+            self.before_flush()
+        self._file.write("".join(self._buffer))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer.clear()
+
+    def _load(self):
+        """Replay the journal into queued, done and asset state"""
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                # A crash can leave a partially written last line
+                if not line.endswith("\n"):
+                    break
+                fields = line.rstrip("\n").split("\t", 2)
+                try:
+                    if fields[0] == "Q":
+                        self.queued.setdefault(fields[2], int(fields[1]))
+                    elif fields[0] == "D":
+                        self.done.add(fields[1])
+                    elif fields[0] == "A":
+                        self.assets[fields[2]] = fields[1]
+                except (IndexError, ValueError):
+                    self.logger.warning("Ignoring malformed journal line: %r", line)
+
+    def _compact(self):
+        """Rewrite the journal with only the recovered state"""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for url, depth in self.queued.items():
+                f.write(f"Q\t{depth}\t{url}\n")
+            for url in self.done:
+                f.write(f"D\t{url}\n")
+            for url, path in self.assets.items():
+                f.write(f"A\t{path}\t{url}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
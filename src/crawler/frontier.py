@@ -0,0 +1,154 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+from collections import deque
+
+from utils.logger import Logger
+
+
+def fingerprint(url):
+    """Compact signed 64-bit fingerprint of a URL"""
+    digest = hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class Frontier:
+    """FIFO crawl frontier with O(1) dedupe that spills to SQLite when large"""
+
+    def __init__(self, memory_limit=100000, spill_path=None):
+        self.logger = Logger(__name__)
+        self.memory_limit = max(1, memory_limit)
+        self.spill_path = spill_path
+
+        # Head of the queue and fingerprints seen since the last spill
+        self._queue = deque()
+        self._seen = set()
+
+        # Number of queue entries and fingerprints currently on disk
+        self._spilled_queue = 0
+        self._spilled_seen = 0
+        self._db = None
+        self._temp_path = None
+
+    def __len__(self):
+        return len(self._queue) + self._spilled_queue
+
+    def seen(self, url):
+        """Check whether a URL has ever been added to the frontier"""
+        fp = fingerprint(url)
+        if fp in self._seen:
+            return True
+        if self._spilled_seen:
+            row = self._db.execute("SELECT 1 FROM seen WHERE fp = ?", (fp,)).fetchone()
+            return row is not None
+        return False
+
+    def filter_unseen(self, urls):
+        """The URLs never added to the frontier, checking spilled ones in one query per chunk"""
+        fps = [(url, fingerprint(url)) for url in urls]
+        fps = [(url, fp) for url, fp in fps if fp not in self._seen]
+        if not self._spilled_seen or not fps:
+            return [url for url, _ in fps]
+
+        spilled = set()
+        for i in range(0, len(fps), 500):
+            chunk = [fp for _, fp in fps[i:i + 500]]
+            spilled.update(fp for fp, in self._db.execute(
+                f"SELECT fp FROM seen WHERE fp IN ({','.join('?' * len(chunk))})", chunk
+            ))
+        return [url for url, fp in fps if fp not in spilled]
+
+    def mark_seen(self, url):
+        """Record a URL as seen without queueing it"""
+        if self.seen(url):
+            return False
+        self._seen.add(fingerprint(url))
+        if len(self._seen) > self.memory_limit:
+            self._spill_seen()
+        return True
+
+    def add(self, url, depth):
+        """Queue a URL unless it was seen before; returns True if it was queued"""
+        if not self.mark_seen(url):
+            return False
+
+        # Once entries are on disk, keep appending there to preserve FIFO order
+        if self._spilled_queue or len(self._queue) >= self.memory_limit:
+            self._connect().execute(
+                "INSERT INTO queue (url, depth) VALUES (?, ?)", (url, depth)
+            )
+            self._spilled_queue += 1
+        else:
+            self._queue.append((url, depth))
+        return True
+
+    def pop(self):
+        """Remove and return the oldest (url, depth) entry, or None if empty"""
+        if not self._queue and self._spilled_queue:
+            self._load_spilled()
+        if not self._queue:
+            return None
+        return self._queue.popleft()
+
+    def done(self, url):
+        """Record that a popped URL has been fully processed (a no-op locally)"""
+
+    def close(self):
+        """Close the spill database and remove it if it was temporary"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self._temp_path:
+            try:
+                os.remove(self._temp_path)
+            except OSError:
+                pass
+            self._temp_path = None
+        self._spilled_queue = 0
+        self._spilled_seen = 0
+
+    def _connect(self):
+        """Open the spill database on first use"""
+        if self._db is None:
+            path = self.spill_path
+            if not path:
+                fd, path = tempfile.mkstemp(prefix="frontier-", suffix=".sqlite")
+                os.close(fd)
+                self._temp_path = path
+            self.logger.info("Frontier exceeded %s entries, spilling to %s", self.memory_limit, path)
+            self._db = sqlite3.connect(path, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=OFF")
+            self._db.execute("PRAGMA synchronous=OFF")
+            self._db.execute("DROP TABLE IF EXISTS queue")
+            self._db.execute("DROP TABLE IF EXISTS seen")
+            self._db.execute(
+                "CREATE TABLE queue (id INTEGER PRIMARY KEY, url TEXT, depth INTEGER)"
+            )
+            self._db.execute("CREATE TABLE seen (fp INTEGER PRIMARY KEY) WITHOUT ROWID")
+        return self._db
+
+    def _spill_seen(self):
+        """Move in-memory fingerprints to disk"""
+        db = self._connect()
+        db.execute("BEGIN")
+        db.executemany(
+            "INSERT OR IGNORE INTO seen (fp) VALUES (?)", ((fp,) for fp in self._seen)
+        )
+        db.execute("COMMIT")
+        self._spilled_seen += len(self._seen)
+        self._seen.clear()
+
+    def _load_spilled(self):
+        """Move the oldest batch of spilled entries back into memory"""
+        db = self._db
+        rows = db.execute(
+            "SELECT id, url, depth FROM queue ORDER BY id LIMIT ?",
+            (self.memory_limit,),
+        ).fetchall()
+        if not rows:
+            self._spilled_queue = 0
+            return
+        db.execute("DELETE FROM queue WHERE id <= ?", (rows[-1][0],))
+        self._queue.extend((url, depth) for _, url, depth in rows)
+        self._spilled_queue -= len(rows)
@@ -0,0 +1,111 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from utils.logger import Logger
+
+
+class ValidatorCache:
+    """Persistent per-URL HTTP validators used for conditional re-fetching
+
+    Each entry keeps the ETag, Last-Modified and content hash of the last
+    response, plus the page's outgoing links or the local path of a
+    downloaded asset so a 304 can be served without the body. Entries only
+    become usable once marked complete, i.e. after their output was written.
+    """
+
+    def __init__(self, path):
+        self.logger = Logger(__name__)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Every write commits at once (cheap in WAL mode), so the write lock
+        # is never held between pages; other processes wait for it briefly
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS validators (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                links TEXT,
+                local_path TEXT,
+                fetched_at REAL,
+                complete INTEGER DEFAULT 0
+            )"""
+        )
+        self._db.commit()
+
+    def get(self, url):
+        """Return the complete cache entry for a URL as a dict, or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified, content_hash, links, local_path, fetched_at "
+                "FROM validators WHERE url = ? AND complete = 1",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "etag": row[0],
+            "last_modified": row[1],
+            "content_hash": row[2],
+            "links": row[3].split("\n") if row[3] else [],
+            "local_path": row[4],
+            "fetched_at": row[5],
+        }
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Build If-None-Match / If-Modified-Since headers from a cache entry"""
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url, headers, content_hash, links=None, local_path=None, complete=False):
+        """Record the validators of a fresh 200 response"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO validators "
+                "(url, etag, last_modified, content_hash, links, local_path, fetched_at, complete) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    headers.get("ETag"),
+                    headers.get("Last-Modified"),
+                    content_hash,
+                    "\n".join(links) if links else None,
+                    local_path,
+                    time.time(),
+                    1 if complete else 0,
+                ),
+            )
+            self._db.commit()
+
+    def mark_complete(self, url):
+        """Mark a page's entry usable once its output has been written"""
+        with self._lock:
+            self._db.execute("UPDATE validators SET complete = 1 WHERE url = ?", (url,))
+            self._db.commit()
+
+    def invalidate(self):
+        """Make every entry unusable, so pages and images are fetched in full again"""
+        with self._lock:
+            self._db.execute("UPDATE validators SET complete = 0")
+            self._db.commit()
+
+    def close(self):
+        """Commit pending writes and close the database"""
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
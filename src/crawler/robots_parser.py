@@ -1,44 +1,339 @@
-from urllib.parse import urlparse
-from urllib.robotparser import RobotFileParser
-
-import requests
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote, unquote
 
 from utils.logger import Logger
+from utils.transport import Transport
 
+# Characters left as-is when paths and rules are normalized for matching
+_SAFE = "/?=&;:@!$'()*+,~"
+_PLAIN = re.compile(r"[A-Za-z0-9_.\-~/?=&;:@!$'()*+,]*\Z")
 
-class RobotsParser:
-    def __init__(self, base_url, user_agent):
+_REQUEST_RATE = re.compile(r"^\s*(\d+)\s*/\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*$", re.IGNORECASE)
+_RATE_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+
+
+def _normalize(path):
+    """Percent-encode a path the same way for rules and URLs"""
+    if _PLAIN.match(path):
+        return path
+    return quote(unquote(path), safe=_SAFE)
+
+
+def _authority_end(url):
+    """Where the scheme and host of a URL end; cheaper than parsing it"""
+    start = url.find("://")
+    if start < 0:
+        return 0
+    end = len(url)
+    for separator in "/?#":
+        index = url.find(separator, start + 3, end)
+        if index >= 0:
+            end = index
+    return end
+
+
+def _path_of(url):
+    """Path, parameters and query of a URL"""
+    path = url[_authority_end(url):].split("#", 1)[0]
+    return path if path.startswith("/") else "/" + path
+
+
+def _unreachable(status):
+    """Whether a robots.txt status is a server error, to be retried rather than stored"""
+    return status >= 500 or status == 429
+
+
+def _product_token(user_agent):
+    """Lowercased leading name of a user agent, which robots.txt groups are matched against"""
+    match = re.match(r"[A-Za-z_-]+", user_agent or "")
+    return match.group(0).lower() if match else ""
+
+
+class RobotsRules:
+    """The rules of one robots.txt that apply to one user agent, compiled for matching
+
+    Matching follows RFC 9309 as Google implements it: the longest matching
+    rule wins and ``allow`` wins a tie, ``*`` matches any run of characters
+    and a trailing ``$`` anchors the end of the URL. Plain rules live in a
+    dict keyed by the rule, and a path is matched by looking up its prefixes
+    of each rule length, longest first. Wildcard rules are joined, longest
+    first, into one alternation, so a single regex match finds the best of
+    them.
+
+    ``unavailable`` marks the rules standing in for a robots.txt that could
+    not be fetched, which disallow everything.
+    """
+
+    def __init__(self, rules=(), crawl_delay=None, request_rate=None, sitemaps=(), unavailable=False):
+        self.crawl_delay = crawl_delay
+        self.request_rate = request_rate  # (requests, seconds)
+        self.sitemaps = list(sitemaps)
+        self.unavailable = unavailable
+
+        self._literal = {}
+        wildcards = []
+        for allow, pattern in rules:
+            if "*" in pattern or pattern.endswith("$"):
+                anchored = pattern.endswith("$")
+                body = pattern[:-1] if anchored else pattern
+                regex = ".*".join(re.escape(_normalize(part)) for part in body.split("*"))
+                wildcards.append((len(pattern), allow, regex + ("$" if anchored else "")))
+            else:
+                key = _normalize(pattern)
+                self._literal[key] = allow or self._literal.get(key, False)
+
+        self._lengths = sorted({len(key) for key in self._literal}, reverse=True)
+
+        # Longest first and, at equal length, allow first: the first
+        # alternative that matches is the winning wildcard rule
+        wildcards.sort(key=lambda rule: (-rule[0], not rule[1]))
+        self._wildcards = [(length, allow) for length, allow, _ in wildcards]
+        self._wildcard_match = re.compile(
+            "|".join(f"({regex})" for _, _, regex in wildcards)
+        ).match if wildcards else None
+
+    @classmethod
+    def parse(cls, text, user_agent):
+        """Compile the group of a robots.txt body that applies to user_agent"""
+        token = _product_token(user_agent)
+        groups = []  # (agents, rules, crawl_delay, request_rate)
+        sitemaps = []
+        current = None
+        in_agents = False
+
+        for line in text.splitlines():
+            line = line.split("#", 1)[0].strip()
+            if ":" not in line:
+                continue
+            key, value = line.split(":", 1)
+            key = key.strip().lower()
+            value = value.strip()
+
+            if key == "user-agent":
+                # Consecutive user-agent lines share one group
+                if not in_agents:
+                    current = {"agents": [], "rules": [], "crawl_delay": None, "request_rate": None}
+                    groups.append(current)
+                current["agents"].append(value.lower())
+                in_agents = True
+                continue
+            in_agents = False
+
+            if key == "sitemap":
+                sitemaps.append(value)
+            elif current is None:
+                continue
+            elif key in ("allow", "disallow"):
+                # An empty disallow allows everything and adds no rule
+                if value:
+                    current["rules"].append((key == "allow", value))
+            elif key == "crawl-delay":
+                try:
+                    current["crawl_delay"] = float(value)
+                except ValueError:
+                    pass
+            elif key == "request-rate":
+                match = _REQUEST_RATE.match(value)
+                if match and int(match.group(1)):
+                    seconds = float(match.group(2)) * _RATE_UNITS[match.group(3).lower()]
+                    current["request_rate"] = (int(match.group(1)), seconds)
+
+        # The most specific matching agent wins; groups naming it are merged
+        best, chosen = -1, []
+        for group in groups:
+            for agent in group["agents"]:
+                if agent == "*":
+                    specificity = 0
+                elif agent and token.startswith(agent):
+                    specificity = len(agent)
+                else:
+                    continue
+                if specificity > best:
+                    best, chosen = specificity, [group]
+                elif specificity == best and group not in chosen:
+                    chosen.append(group)
+
+        rules = [rule for group in chosen for rule in group["rules"]]
+        crawl_delay = next((g["crawl_delay"] for g in chosen if g["crawl_delay"] is not None), None)
+        request_rate = next((g["request_rate"] for g in chosen if g["request_rate"] is not None), None)
+        return cls(rules, crawl_delay, request_rate, sitemaps)
+
+    def allowed(self, url):
+        """Check a URL, or its path and query, against the rules"""
+        if not self._literal and not self._wildcards:
+            return True
+        path = _path_of(url)
+        if path == "/robots.txt":
+            return True
+        path = _normalize(path)
+
+        best_length, best_allow = -1, True
+        size = len(path)
+        for length in self._lengths:
+            if length > size:
+                continue
+            allow = self._literal.get(path[:length])
+            if allow is not None:
+                best_length, best_allow = length, allow
+                break
+
+        if self._wildcard_match is not None:
+            match = self._wildcard_match(path)
+            if match:
+                length, allow = self._wildcards[match.lastindex - 1]
+                if length > best_length or (length == best_length and allow):
+                    best_allow = allow
+        return best_allow
+
+    @property
+    def delay(self):
+        """Seconds to leave between requests, from Crawl-delay or Request-rate"""
+        delays = [self.crawl_delay or 0]
+        if self.request_rate:
+            requests, seconds = self.request_rate
+            delays.append(seconds / requests)
+        return max(delays)
+
+
+class RobotsCache:
+    """Compiled robots.txt rules per host, kept in memory and optionally on disk
+
+    Fetched bodies are stored in SQLite with their fetch time and reused by
+    later runs until ``ttl`` seconds old, so a re-crawl or a batch of sites
+    on the same host fetches each robots.txt once. A missing robots.txt
+    (a 4xx status) allows everything. An unreachable one (a 5xx or 429
+    status, or a failed fetch) disallows everything, as RFC 9309 asks, and
+    is not stored, so the next run fetches it again.
+    """
+
+    def __init__(self, path=None, ttl=86400, user_agent=None, transport=None):
         self.logger = Logger(__name__)
-        self.user_agent = user_agent
-        self.rp = RobotFileParser()
+        self.ttl = ttl
+        self.transport = transport or Transport(user_agent)
+        self.user_agent = user_agent or self.transport.user_agent
+
+        self._lock = threading.Lock()
+        self._rules = {}
+        self._db = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            # Other workers of a distributed crawl may share the file
+            self._db = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS robots ("
+                "origin TEXT PRIMARY KEY, status INTEGER, body TEXT, fetched_at REAL)"
+            )
+            self._db.commit()
+
+    def rules_for(self, url):
+        """Rules of the host serving url, fetching its robots.txt if not cached"""
+        origin = url[:_authority_end(url)]
+        rules = self._rules.get(origin)
+        if rules is not None:
+            return rules
+        with self._lock:
+            rules = self._rules.get(origin)
+            if rules is None:
+                rules = self._rules[origin] = self._load(origin)
+            return rules
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
 
+    def _load(self, origin):
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT status, body, fetched_at FROM robots WHERE origin = ?", (origin,)
+            ).fetchone()
+            if row and time.time() - row[2] < self.ttl and not _unreachable(row[0]):
+                self.logger.debug("Using cached robots.txt of %s", origin)
+                return self._compile(origin, row[0], row[1])
+
+        robots_url = f"{origin}/robots.txt"
+        self.logger.info("Fetching robots.txt from %s", robots_url)
         try:
-            # Construct robots.txt URL
-            parsed = urlparse(base_url)
-            robots_url = f"{parsed.scheme}://{parsed.netloc}/robots.txt"
+            response = self.transport.get(robots_url)
+            status, body = response.status_code, response.text
+        except Exception as e:
+            return self._unavailable(origin, f"{type(e).__name__}: {e}")
+        if _unreachable(status):
+            return self._unavailable(origin, status)
 
-            self.logger.info(f"Fetching robots.txt from {robots_url}")
-            response = requests.get(robots_url, timeout=10)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO robots (origin, status, body, fetched_at) VALUES (?, ?, ?, ?)",
+                (origin, status, body, time.time()),
+            )
+            self._db.commit()
+        return self._compile(origin, status, body)
 
-            if response.status_code == 200:
-                self.rp.parse(response.text.splitlines())
-                self.logger.info("Successfully parsed robots.txt")
-            else:
-                self.logger.warning(
-                    f"Could not fetch robots.txt ({response.status_code}), assuming all URLs allowed"
-                )
-                # If robots.txt doesn't exist, allow all
-                self.rp.allow_all = True
+    def _unavailable(self, origin, reason):
+        self.logger.warning(
+            "robots.txt of %s is unavailable (%s), assuming all URLs disallowed this run", origin, reason
+        )
+        return RobotsRules([(False, "/")], unavailable=True)
 
+    def _compile(self, origin, status, body):
+        if status != 200:
+            self.logger.warning(
+                "Could not fetch robots.txt of %s (%s), assuming all URLs allowed", origin, status
+            )
+            return RobotsRules()
+        try:
+            rules = RobotsRules.parse(body, self.user_agent)
+            self.logger.info("Successfully parsed robots.txt of %s", origin)
+            return rules
         except Exception as e:
-            self.logger.error(f"Error processing robots.txt: {e}")
-            # Be permissive on error
-            self.rp.allow_all = True
+            self.logger.error("Error processing robots.txt: %s", e)
+            return RobotsRules()
+
+
+class RobotsParser:
+    """robots.txt checks for a crawl, starting from its base URL's host"""
+
+    def __init__(self, base_url, user_agent, transport=None, cache=None):
+        self.logger = Logger(__name__)
+        self.user_agent = user_agent
+        self.transport = transport or Transport(user_agent)
+        self.cache = cache or RobotsCache(user_agent=user_agent, transport=self.transport)
+        # The base host's rules are needed straight away for sitemaps and delays
+        self.rules = self.cache.rules_for(base_url)
 
     def can_fetch(self, url):
         """Check if URL is allowed by robots.txt"""
         try:
-            return self.rp.can_fetch(self.user_agent, url)
+            return self.cache.rules_for(url).allowed(url)
         except Exception as e:
-            self.logger.error(f"Error checking robots.txt rules for {url}: {e}")
+            self.logger.error("Error checking robots.txt rules for %s: %s", url, e)
             return True  # Allow if there's an error checking
+
+    def delay_for(self, url):
+        """Seconds robots.txt asks to leave between requests to url's host"""
+        try:
+            return self.cache.rules_for(url).delay
+        except Exception as e:
+            self.logger.error("Error reading Crawl-delay for %s: %s", url, e)
+            return 0
+
+    @property
+    def crawl_delay(self):
+        """Crawl-delay of the base host, or None"""
+        return self.rules.crawl_delay
+
+    @property
+    def request_rate(self):
+        """Request-rate of the base host as (requests, seconds), or None"""
+        return self.rules.request_rate
+
+    @property
+    def sitemaps(self):
+        """Sitemap URLs listed in robots.txt"""
+        return self.rules.sitemaps
@@ -0,0 +1,121 @@
+import asyncio
+from collections import deque
+
+from crawler.spider import _DONE, iter_crawl_results
+from utils.logger import Logger
+
+
+class _SiteResults:
+    """Result queue view that tags every page with the spider that fetched it"""
+
+    __slots__ = ("results", "spider")
+
+    def __init__(self, results, spider):
+        self.results = results
+        self.spider = spider
+
+    def put(self, item, timeout=None):
+        self.results.put((self.spider, item), timeout=timeout)
+
+
+class CrawlScheduler:
+    """Crawl several sites in one event loop under a global concurrency budget
+
+    All spiders share one aiohttp session and one set of per-host slots and
+    Crawl-delay pacing, so sites on the same host are polite to it together. Dispatch is
+    round-robin: each pass hands at most one new fetch to every site that
+    has queued URLs and is below its own limit, so a site with a huge
+    frontier gets no larger share of the budget than a small one.
+
+    A site's limit is the smaller of its ``concurrency`` and
+    ``per_host_concurrency``. A site is a single host, and fetches beyond its
+    host slots would only hold budget while they wait.
+    """
+
+    def __init__(self, spiders, transport, concurrency=64, per_host_concurrency=4):
+        self.logger = Logger(__name__)
+        self.spiders = list(spiders)
+        self.transport = transport
+        self.concurrency = max(1, concurrency)
+        self.per_host_concurrency = max(1, per_host_concurrency)
+
+    def crawl(self):
+        """Crawl every site and yield (spider, (url, html, tree)) as pages arrive"""
+        self.logger.info(
+            "Starting batch crawl of %s sites (%s concurrent overall)",
+            len(self.spiders), self.concurrency
+        )
+        yield from iter_crawl_results(self._run_loop, self.concurrency * 2)
+
+    def _run_loop(self, results, stop):
+        try:
+            asyncio.run(self._crawl_async(results, stop))
+        except Exception as e:
+            self.logger.error("Batch crawl aborted: %s", e)
+        finally:
+            results.put(_DONE)
+
+    async def _crawl_async(self, results, stop):
+        host_slots = {}
+        host_next = {}
+        for spider in self.spiders:
+            spider._host_slots = host_slots
+            spider._host_next = host_next
+
+        sites = deque(self.spiders)
+        site_results = {spider: _SiteResults(results, spider) for spider in self.spiders}
+        in_flight = dict.fromkeys(self.spiders, 0)
+        pending = {}
+
+        async with self.transport.async_session(
+            self.concurrency, self.per_host_concurrency
+        ) as session:
+            while not stop.is_set():
+                self._dispatch(session, sites, site_results, in_flight, pending, stop)
+                if not pending:
+                    break
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    spider = pending.pop(task)
+                    in_flight[spider] -= 1
+                    if not in_flight[spider] and not len(spider.frontier):
+                        self.logger.info("Finished crawling %s", spider.base_url)
+
+            for task in pending:
+                task.cancel()
+
+        if not pending and not stop.is_set():
+            for spider in self.spiders:
+                spider.completed = True
+
+        for spider in self.spiders:
+            spider.frontier.close()
+
+    def _dispatch(self, session, sites, site_results, in_flight, pending, stop):
+        """Fill the budget one URL per site per round"""
+        while len(pending) < self.concurrency:
+            dispatched = False
+            for _ in range(len(sites)):
+                if len(pending) >= self.concurrency:
+                    break
+                spider = sites[0]
+                sites.rotate(-1)
+
+                limit = min(spider.concurrency, spider.per_host_concurrency)
+                if in_flight[spider] >= limit or not len(spider.frontier):
+                    continue
+
+                entry = spider.frontier.pop()
+                if entry is None:
+                    continue
+                url, depth = entry
+                task = asyncio.ensure_future(
+                    spider._fetch(session, url, depth, site_results[spider], stop)
+                )
+                pending[task] = spider
+                in_flight[spider] += 1
+                dispatched = True
+
+            if not dispatched:
+                return
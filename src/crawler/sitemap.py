@@ -0,0 +1,122 @@
+import gzip
+import io
+from datetime import datetime, timezone
+from xml.etree.ElementTree import ParseError, iterparse
+
+from utils.logger import Logger
+
+# First bytes of a gzip stream
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def parse_lastmod(value):
+    """Parse a sitemap <lastmod> (W3C datetime) into a UTC timestamp, or None"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class _ChunkStream(io.RawIOBase):
+    """Read-only file object over an iterator of byte chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            self._pending = next(self._chunks, None)
+            if self._pending is None:
+                self._pending = b""
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class SitemapReader:
+    """Stream page URLs out of sitemaps, sitemap indexes and gzipped sitemaps
+
+    Documents are parsed incrementally straight off the response stream and
+    every finished element is discarded, so memory stays bounded no matter
+    how large a sitemap is.
+    """
+
+    def __init__(self, transport, max_sitemaps=1000):
+        self.logger = Logger(__name__)
+        self.transport = transport
+        self.max_sitemaps = max_sitemaps
+
+    def iter_urls(self, sitemap_urls):
+        """Yield (url, lastmod) for every page, following sitemap indexes"""
+        pending = list(sitemap_urls)
+        seen = set(pending)
+        fetched = 0
+
+        while pending and fetched < self.max_sitemaps:
+            sitemap_url = pending.pop(0)
+            fetched += 1
+            for kind, loc, lastmod in self._read(sitemap_url):
+                if kind == "url":
+                    yield loc, lastmod
+                elif loc not in seen:
+                    seen.add(loc)
+                    pending.append(loc)
+
+        if pending:
+            self.logger.warning(
+                "Stopped after %s sitemaps, %s left unread", self.max_sitemaps, len(pending)
+            )
+
+    def _read(self, sitemap_url):
+        """Yield ("url" | "sitemap", loc, lastmod) entries of one sitemap document"""
+        try:
+            self.logger.info("Reading sitemap %s", sitemap_url)
+            response = self.transport.get(sitemap_url, stream=True)
+            if response.status_code != 200:
+                self.logger.warning(
+                    "Could not fetch sitemap %s (%s)", sitemap_url, response.status_code
+                )
+                response.close()
+                return
+
+            # Content-Encoding is undone by requests; .gz files are gzip themselves
+            stream = io.BufferedReader(_ChunkStream(response.iter_content(64 * 1024)))
+            if stream.peek(2)[:2] == _GZIP_MAGIC:
+                stream = gzip.GzipFile(fileobj=stream)
+
+            with response:
+                root = None
+                loc = lastmod = None
+                for event, elem in iterparse(stream, events=("start", "end")):
+                    if root is None:
+                        root = elem
+                    if event != "end":
+                        continue
+
+                    tag = elem.tag.rsplit("}", 1)[-1]
+                    if tag == "loc":
+                        loc = (elem.text or "").strip()
+                    elif tag == "lastmod":
+                        lastmod = (elem.text or "").strip()
+                    elif tag in ("url", "sitemap"):
+                        if loc:
+                            yield tag, loc, lastmod
+                        loc = lastmod = None
+                        # Drop finished entries so the tree never grows
+                        root.clear()
+
+        except (ParseError, OSError, EOFError) as e:
+            self.logger.error("Error parsing sitemap %s: %s", sitemap_url, e)
+        except Exception as e:
+            self.logger.error("Error reading sitemap %s: %s", sitemap_url, e)
@@ -1,35 +1,141 @@
-import re
+import asyncio
+import hashlib
+import queue
+import threading
 import time
 from urllib.parse import urljoin, urlparse
 
-import requests
-from bs4 import BeautifulSoup
+import aiohttp
+from lxml import etree
 
+from crawler.frontier import Frontier
 from crawler.robots_parser import RobotsParser
+from crawler.sitemap import SitemapReader, parse_lastmod
+from crawler.url_canon import BaseURL, TrapDetector, URLCanonicalizer
+from parser.dom import decode_html, parse_html
 from utils.logger import Logger
+from utils.metrics import Metrics
+from utils.transport import Transport
+
+# Marks the end of the crawl on the result queue
+_DONE = object()
+
+# Every href of a page as plain strings
+_HREFS = etree.XPath("//a/@href", smart_strings=False)
+
+# Canonical forms remembered for links that recur across pages
+_CANONICAL_CACHE_SIZE = 65536
+
+# Seconds between checks of a shared frontier whose URLs are all leased elsewhere
+_IDLE_POLL_INTERVAL = 1.0
+
+
+def iter_crawl_results(run, maxsize):
+    """Run ``run(results, stop)`` in a background thread and yield what it queues
+
+    ``run`` must put ``_DONE`` on the queue when it finishes. The queue is
+    bounded, so a slow consumer throttles the producer. Closing the
+    generator stops the producer and waits for its thread.
+    """
+    results = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    thread = threading.Thread(target=run, args=(results, stop), name="spider", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+        # Unblock the fetch thread if it is waiting on a full queue
+        while thread.is_alive():
+            try:
+                results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
 
 
 class WebSpider:
-    def __init__(self, base_url, max_depth=5, delay=1, user_agent=None):
-        self.base_url = base_url
+    def __init__(
+        self,
+        base_url,
+        max_depth=5,
+        delay=1,
+        user_agent=None,
+        concurrency=16,
+        per_host_concurrency=4,
+        frontier_memory_limit=100000,
+        frontier_spill_path=None,
+        cache=None,
+        journal=None,
+        transport=None,
+        discovery="links",
+        max_body_size=10 * 1024 * 1024,
+        canonicalizer=None,
+        trap_detector=None,
+        metrics=None,
+        frontier=None,
+        robots_cache=None,
+        respect_crawl_delay=True,
+        max_crawl_delay=30,
+        on_keep=None,
+        capture=None,
+    ):
+        # Link normalization before dedupe, and throttling of URL traps
+        self.canonicalizer = canonicalizer or URLCanonicalizer()
+        self.trap_detector = trap_detector or TrapDetector()
+        self._canonical = {}
+
+        # Discovered links are canonical (lowercase host, no default port),
+        # so the start URL and the scope check take the same form
+        self.base_url = self.canonicalizer.canonicalize(base_url)
         self.max_depth = max_depth
-        self.delay = delay  # Time to wait between requests in seconds
-        self.visited = set()
-        self.to_visit = [(base_url, 0)]
+        self.delay = delay  # Time each fetch slot waits before a request, in seconds
+        self.max_body_size = max_body_size  # Larger pages are abandoned mid-download
+        # A shared frontier (distributed mode) replaces the local one
+        if frontier is None:
+            frontier = Frontier(frontier_memory_limit, frontier_spill_path)
+        self.frontier = frontier
         self.logger = Logger(__name__)
 
-        # Set up user agent for requests
-        self.user_agent = user_agent or "WebToMarkdown Bot"
-        self.headers = {"User-Agent": self.user_agent}
+        # Validator cache for conditional re-fetching (optional)
+        self.cache = cache
+
+        # Progress journal for resuming interrupted crawls (optional)
+        self.journal = journal
+
+        # Number of requests allowed in flight overall and per host
+        self.concurrency = max(1, concurrency)
+        self.per_host_concurrency = max(1, per_host_concurrency)
+        self._host_slots = {}
+
+        # Crawl-delay / Request-rate pacing: earliest next request start per host
+        self.respect_crawl_delay = respect_crawl_delay
+        self.max_crawl_delay = max_crawl_delay  # Longer robots.txt delays are capped
+        self._host_next = {}
+
+        # Shared HTTP transport, which also owns the user agent
+        self.transport = transport or Transport(user_agent)
+        self.user_agent = self.transport.user_agent
 
         # Domain for filtering external links
-        self.domain = urlparse(base_url).netloc
+        self.domain = urlparse(self.base_url).netloc
 
         # Set up robots.txt parser
-        self.robots_parser = RobotsParser(base_url, self.user_agent)
+        self.robots_parser = RobotsParser(self.base_url, self.user_agent, self.transport, robots_cache)
+        robots_delay = self.robots_parser.rules.delay
+        if respect_crawl_delay and robots_delay:
+            self.logger.info(
+                "Pacing %s at %gs per request (robots.txt)",
+                self.domain, min(robots_delay, max_crawl_delay)
+            )
 
         # File extensions to skip
-        self.skip_extensions = {
+        self.skip_extensions = {  # lowercase, with the dot; matched against the last suffix
             ".pdf",
             ".zip",
             ".rar",
@@ -44,120 +150,397 @@ class WebSpider:
             ".exe",
         }
 
-    def _is_valid_url(self, url):
-        """Filter out invalid URLs, external links, and already visited pages"""
-        try:
-            parsed = urlparse(url)
+        # Where pages are discovered: "links" follows <a> tags, "sitemap"
+        # fetches exactly the sitemap's pages, "both" seeds from the sitemap
+        # and keeps following links
+        self.discovery = discovery
+        self.follow_links = discovery != "sitemap"
 
-            # Check if URL is valid
-            if not parsed.scheme or not parsed.netloc:
-                return False
+        # Fetch latencies and crawl counters (a disabled no-op by default)
+        self.metrics = metrics or Metrics(enabled=False)
 
-            # Check if URL is already visited
-            if url in self.visited:
-                return False
+        # Sitemap <lastmod> timestamps of seeded URLs
+        self.lastmod = {}
 
-            # Check if URL is from the same domain
-            if parsed.netloc != self.domain:
-                return False
+        # Called with each URL whose earlier output stays current without a
+        # rewrite, and whether it failed: unchanged pages and pages failing
+        # only temporarily (or a failing start page)
+        self.on_keep = on_keep
 
-            # Check file extension
-            path = parsed.path.lower()
-            if any(path.endswith(ext) for ext in self.skip_extensions):
-                return False
+        # Set once every queued URL was fetched, i.e. not stopped or aborted,
+        # and the number of kept URLs on_keep failed to record
+        self.completed = False
+        self.keep_errors = 0
 
-            # Check robots.txt rules
-            if not self.robots_parser.can_fetch(url):
-                self.logger.debug(f"Skipping {url} (blocked by robots.txt)")
-                return False
+        # Store of fetched responses for offline re-conversion (optional)
+        self.capture = capture
 
-            return True
+        if journal and journal.resumed:
+            self._restore(journal)
+        else:
+            self._enqueue(self.base_url, 0)
+            if discovery in ("sitemap", "both"):
+                self._seed_from_sitemaps()
 
-        except Exception as e:
-            self.logger.error(f"Error validating URL {url}: {e}")
+    def _is_valid_url(self, url):
+        """Filter out invalid URLs, external links, and already visited pages"""
+        return bool(self._filter_links([url]))
+
+    def _filter_links(self, urls):
+        """Keep the in-scope, unseen URLs robots.txt allows, checking the seen-set once"""
+        in_scope = []
+        for url in urls:
+            try:
+                if self._in_scope(url):
+                    in_scope.append(url)
+            except Exception as e:
+                self.logger.error("Error validating URL %s: %s", url, e)
+
+        links = []
+        for url in self.frontier.filter_unseen(in_scope):
+            if self.robots_parser.can_fetch(url):
+                links.append(url)
+            else:
+                self.logger.debug("Skipping %s (blocked by robots.txt)", url)
+        return links
+
+    def _in_scope(self, url):
+        """Check scheme, host and file extension without a full URL parse"""
+        scheme, sep, rest = url.partition("://")
+        if not sep or not scheme:
+            return False
+        for separator in "#?":
+            rest = rest.split(separator, 1)[0]
+        netloc, _, path = rest.partition("/")
+        if netloc != self.domain:
             return False
 
+        # Only the last suffix of the last segment can be a skipped extension
+        name = path[path.rfind("/") + 1:]
+        dot = name.rfind(".")
+        return dot < 0 or name[dot:].lower() not in self.skip_extensions
+
     def normalize_url(self, base, url):
         """Convert a relative URL to an absolute URL"""
         return urljoin(base, url)
 
-    def _extract_links(self, soup, current_url):
+    def _extract_links(self, tree, current_url):
         """Extract and normalize all links from the page"""
-        links = []
-        for link in soup.find_all("a", href=True):
+        base = BaseURL(current_url)
+        canonical_cache = self._canonical
+
+        # Repeated hrefs are resolved once; so are links canonicalizing alike
+        urls = {}
+        for href in dict.fromkeys(_HREFS(tree)):
             try:
-                href = link["href"].strip()
+                href = href.strip()
                 # Skip empty links and javascript links
-                if not href or href.startswith("javascript:") or href.startswith("#"):
+                if not href or href.startswith(("javascript:", "#")):
                     continue
 
-                # Normalize URL
-                full_url = self.normalize_url(current_url, href)
-
-                # Remove fragments and normalize
-                full_url = re.sub(r"#.*$", "", full_url)
+                absolute = base.resolve(href)
+                if absolute is None:
+                    continue
 
-                if self._is_valid_url(full_url):
-                    links.append(full_url)
+                # Canonicalize so equivalent URLs dedupe together
+                url = canonical_cache.get(absolute)
+                if url is None:
+                    if len(canonical_cache) >= _CANONICAL_CACHE_SIZE:
+                        canonical_cache.clear()
+                    url = canonical_cache[absolute] = self.canonicalizer.canonicalize(absolute)
+                urls[url] = None
 
             except Exception as e:
-                self.logger.error(f"Error extracting link {link}: {e}")
+                self.logger.error("Error extracting link %s: %s", href, e)
 
-        return links
+        return self._filter_links(urls)
 
     def crawl(self):
-        """Crawl pages up to the specified depth and yield URL and HTML content"""
+        """Crawl pages up to the specified depth and yield URL, HTML and parsed tree"""
         self.logger.info(
-            f"Starting crawl of {self.base_url} with max depth {self.max_depth}"
+            "Starting crawl of %s with max depth %s (%s concurrent, %s per host)",
+            self.base_url, self.max_depth, self.concurrency, self.per_host_concurrency
         )
 
-        while self.to_visit:
-            url, depth = self.to_visit.pop(0)
+        # The event loop runs in a background thread and hands pages over
+        # through a bounded queue, so a slow consumer throttles fetching
+        yield from iter_crawl_results(self._run_loop, self.concurrency * 2)
 
-            if url in self.visited:
-                continue
+    def _run_loop(self, results, stop):
+        """Run the asynchronous crawl to completion in the current thread"""
+        try:
+            asyncio.run(self._crawl_async(results, stop))
+        except Exception as e:
+            self.logger.error("Crawl aborted: %s", e)
+        finally:
+            results.put(_DONE)
+
+    async def _crawl_async(self, results, stop):
+        """Dispatch fetches from the frontier while keeping the pool full"""
+        async with self.transport.async_session(
+            self.concurrency, self.per_host_concurrency
+        ) as session:
+            pending = set()
+            while not stop.is_set():
+                while len(pending) < self.concurrency:
+                    entry = self.frontier.pop()
+                    if entry is None:
+                        break
+                    url, depth = entry
+                    pending.add(
+                        asyncio.ensure_future(
+                            self._fetch(session, url, depth, results, stop)
+                        )
+                    )
 
-            if depth > self.max_depth:
-                continue
+                if not pending:
+                    if not len(self.frontier):
+                        self.completed = True
+                        break
+                    # Other workers hold the remaining URLs; wait for them to
+                    # finish or for their leases to expire
+                    await asyncio.sleep(_IDLE_POLL_INTERVAL)
+                    continue
 
+                _, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+
+            for task in pending:
+                task.cancel()
+
+        self.frontier.close()
+
+    def _host_slot(self, url):
+        """Get the semaphore limiting concurrent requests to a URL's host"""
+        host = urlparse(url).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return self._host_slots[host]
+
+    def _wait_before(self, url):
+        """Seconds to wait before requesting url: the configured delay, or longer to pace the host"""
+        interval = 0
+        if self.respect_crawl_delay:
+            interval = min(self.robots_parser.delay_for(url), self.max_crawl_delay)
+        if not interval:
+            return self.delay
+
+        # Reserve the host's next start time so concurrent slots space out
+        host = urlparse(url).netloc
+        now = time.monotonic()
+        start = max(now, self._host_next.get(host, 0))
+        self._host_next[host] = start + interval
+        return max(start - now, self.delay)
+
+    def _restore(self, journal):
+        """Rebuild the frontier from a journal: finished URLs stay seen, the rest are re-queued"""
+        for url in journal.done:
+            self.frontier.mark_seen(url)
+        for url, depth in journal.pending():
+            self.frontier.add(url, depth)
+
+    def _seed_from_sitemaps(self):
+        """Queue every in-scope page listed in the site's sitemaps"""
+        parsed = urlparse(self.base_url)
+        sitemap_urls = self.robots_parser.sitemaps or [
+            f"{parsed.scheme}://{parsed.netloc}/sitemap.xml"
+        ]
+
+        seeded = 0
+        for url, lastmod in SitemapReader(self.transport).iter_urls(sitemap_urls):
+            url = self.canonicalizer.canonicalize(url)
+            # Sitemaps usually cover the whole site; keep pages under the target
+            if not url.startswith(self.base_url) or not self._is_valid_url(url):
+                continue
+            timestamp = parse_lastmod(lastmod)
+            if timestamp is not None:
+                self.lastmod[url] = timestamp
+            self._enqueue(url, 0)
+            seeded += 1
+
+        self.logger.info("Seeded %s URLs from %s sitemap(s)", seeded, len(sitemap_urls))
+
+    def _enqueue(self, url, depth):
+        """Add a URL to the frontier, journaling it if it is new"""
+        # Only URLs not seen before count towards trap limits
+        if self.frontier.seen(url) or not self.trap_detector.allow(url):
+            return
+        if self.frontier.add(url, depth) and self.journal:
+            self.journal.record_queued(url, depth)
+
+    async def _fetch(self, session, url, depth, results, stop):
+        """Fetch a page and journal it as done unless it went to the consumer"""
+        try:
+            handed_over = await self._fetch_page(session, url, depth, results, stop)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.error("Request error crawling %s: %s", url, e)
+            self.metrics.inc("errors")
+            self._keep(url, failed=True)
+            handed_over = False
+        except Exception as e:
+            self.logger.error("Error crawling %s: %s", url, e)
+            self.metrics.inc("errors")
+            self._keep(url, failed=True)
+            handed_over = False
+
+        # Pages handed over are journaled by the consumer once written;
+        # the frontier slot is released even if journaling fails
+        if not handed_over:
             try:
-                # Respect crawl delay
-                time.sleep(self.delay)
-
-                self.logger.info(f"Crawling {url} (depth {depth})")
-                response = requests.get(url, headers=self.headers, timeout=30)
+                if self.journal:
+                    self.journal.record_done(url)
+            except Exception as e:
+                self.logger.error("Error journaling %s: %s", url, e)
+            finally:
+                self.frontier.done(url)
+
+    async def _fetch_page(self, session, url, depth, results, stop):
+        """Fetch a single page, queue its links and hand it to the consumer"""
+        # Nothing may be fetched while robots.txt is unavailable; the page
+        # counts as failing, so its earlier output is kept, not pruned
+        if self.robots_parser.rules.unavailable:
+            self.logger.debug("Not fetching %s: robots.txt is unavailable", url)
+            self._keep(url, failed=True)
+            return False
 
-                # Skip non-HTML responses
-                if "text/html" not in response.headers.get("Content-Type", ""):
-                    self.logger.debug(f"Skipping non-HTML content: {url}")
-                    self.visited.add(url)
-                    continue
+        cached = self.cache.get(url) if self.cache else None
+        # Pages not captured yet are fetched in full so the capture covers them
+        if cached and self.capture and not self.capture.has(url):
+            cached = None
+
+        # The sitemap says the page has not changed since we last fetched it
+        if cached and url in self.lastmod and self.lastmod[url] <= cached["fetched_at"]:
+            self.logger.debug("Unchanged per sitemap lastmod: %s", url)
+            self.metrics.inc("unchanged")
+            self._queue_links(cached["links"], depth, validate=True)
+            self._keep(url)
+            return False
 
-                # Skip error status codes
-                if response.status_code != 200:
+        async with self._host_slot(url):
+            # Respect crawl delay
+            await asyncio.sleep(self._wait_before(url))
+
+            self.logger.info("Crawling %s (depth %s)", url, depth)
+            headers = self.cache.conditional_headers(cached) if cached else None
+            started = time.perf_counter()
+            response = await self.transport.async_get(session, url, headers)
+            async with response:
+                # Unchanged since the last run: reuse its links, skip conversion
+                if response.status == 304 and cached:
+                    self.logger.debug("Not modified: %s", url)
+                    self.metrics.inc("not_modified")
+                    self._queue_links(cached["links"], depth, validate=True)
+                    self._keep(url)
+                    return False
+
+                # Headers decide before any of the body is downloaded; closing
+                # drops the connection instead of draining an unwanted body
+                if response.status != 200:
                     self.logger.warning(
-                        f"Got status code {response.status_code} for {url}"
+                        "Got status code %s for %s", response.status, url
                     )
-                    self.visited.add(url)
-                    continue
-
-                soup = BeautifulSoup(response.content.decode('utf-8'), "html.parser")
-                self.visited.add(url)
+                    self.metrics.inc("http_errors")
+                    # Server trouble is not a removed page, and without its
+                    # start page the crawl cannot tell what was removed
+                    if response.status >= 500 or response.status == 429 or url == self.base_url:
+                        self._keep(url, failed=True)
+                    response.close()
+                    return False
 
-                # Extract links for future crawling
-                links = self._extract_links(soup, url)
-                for link in links:
-                    if (
-                        link not in self.visited
-                        and (link, depth + 1) not in self.to_visit
-                    ):
-                        self.to_visit.append((link, depth + 1))
-
-                yield url, response.content.decode("utf-8")
+                # Skip non-HTML responses
+                if "text/html" not in response.headers.get("Content-Type", ""):
+                    self.logger.debug("Skipping non-HTML content: %s", url)
+                    response.close()
+                    return False
+
+                body = await self._read_body(response, url)
+                if body is None:
+                    return False
+                self.metrics.observe("fetch", time.perf_counter() - started)
+                self.metrics.inc("pages_fetched")
+                self.metrics.inc("bytes_fetched", len(body))
+                response_headers = response.headers
+                charset = response.charset
+
+        content_hash = hashlib.sha256(body).hexdigest()
+        if cached and cached["content_hash"] == content_hash:
+            # Server ignored the validators but the body is identical
+            self.logger.debug("Unchanged content: %s", url)
+            self.metrics.inc("unchanged")
+            self._queue_links(cached["links"], depth, validate=True)
+            self._keep(url)
+            return False
 
-            except requests.exceptions.RequestException as e:
-                self.logger.error(f"Request error crawling {url}: {e}")
-                self.visited.add(url)  # Mark as visited to avoid retrying
+        loop = asyncio.get_running_loop()
+        if self.capture:
+            # Compressed and stored off the event loop
+            await loop.run_in_executor(
+                None, self.capture.record, url, 200, response_headers, charset, body, content_hash
+            )
+
+        html = decode_html(body, charset)
+        tree = parse_html(html)
+
+        # Extract links for future crawling
+        if self.follow_links and depth < self.max_depth:
+            links = self._extract_links(tree, url)
+        else:
+            links = []
+        self._queue_links(links, depth)
+
+        if self.cache:
+            self.cache.store(url, response_headers, content_hash, links)
+
+        # Hand the page over without blocking the event loop
+        await loop.run_in_executor(None, self._put_result, results, stop, (url, html, tree))
+        return True
+
+    async def _read_body(self, response, url):
+        """Read a response body, giving up once it exceeds max_body_size"""
+        if response.content_length and response.content_length > self.max_body_size:
+            self.logger.warning(
+                "Skipping %s: %s bytes exceeds max_body_size", url, response.content_length
+            )
+            response.close()
+            return None
+
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            body += chunk
+            if len(body) > self.max_body_size:
+                self.logger.warning("Aborting %s: body exceeds max_body_size", url)
+                response.close()
+                return None
+        return bytes(body)
+
+    def _keep(self, url, failed=False):
+        """Report a URL whose earlier output is still current
+
+        Called from the error handlers of a fetch, so it never raises.
+        """
+        if self.on_keep:
+            try:
+                self.on_keep(url, failed)
             except Exception as e:
-                self.logger.error(f"Error crawling {url}: {e}")
-                self.visited.add(url)
+                self.keep_errors += 1
+                self.logger.error("Error keeping the output of %s: %s", url, e)
+
+    def _queue_links(self, links, depth, validate=False):
+        """Add the links found on a page at the given depth to the frontier"""
+        if depth < self.max_depth:
+            # Links replayed from the cache are re-checked against current rules
+            if validate:
+                links = self._filter_links(links)
+            for link in links:
+                self._enqueue(link, depth + 1)
+
+    @staticmethod
+    def _put_result(results, stop, item):
+        """Put an item on the result queue unless the crawl has been stopped"""
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
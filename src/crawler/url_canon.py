@@ -0,0 +1,199 @@
+import re
+from collections import Counter
+from fnmatch import fnmatchcase
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urljoin, urlsplit, urlunsplit
+
+from utils.logger import Logger
+
+# Tracking and session parameters that never change page content
+DEFAULT_DENY_PARAMS = (
+    "utm_*",
+    "gclid",
+    "fbclid",
+    "msclkid",
+    "mc_cid",
+    "mc_eid",
+    "_ga",
+    "ref",
+    "sessionid",
+    "session_id",
+    "sid",
+    "jsessionid",
+    "phpsessid",
+    "aspsessionid*",
+)
+
+# Directory index documents that alias their directory
+DEFAULT_INDEX_NAMES = ("index.html", "index.htm", "index.php", "default.htm", "default.aspx")
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# ;jsessionid=... style session ids embedded in the path
+_PATH_SESSION = re.compile(r";(?:jsessionid|sid|phpsessid)=[^/?#]*", re.I)
+
+# Characters left unescaped when re-quoting paths
+_PATH_SAFE = "/:@!$&'()*+,;=~-._"
+
+_DIGITS = re.compile(r"\d+")
+
+_SCHEME = re.compile(r"([A-Za-z][A-Za-z0-9+.-]*):")
+
+
+class BaseURL:
+    """A page URL split once, for resolving many of its links
+
+    ``resolve`` builds absolute URLs by concatenation, leaving ``.`` and
+    ``..`` segments in place; ``URLCanonicalizer`` resolves those, so the
+    canonical result equals that of ``urljoin`` (barring ``..`` after an
+    empty segment, as in ``a//..``). Links to schemes other than http and
+    https resolve to None.
+    """
+
+    __slots__ = ("url", "scheme", "origin", "path", "directory")
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.url = url
+        self.scheme = parts.scheme
+        self.origin = f"{parts.scheme}://{parts.netloc}"
+        self.path = parts.path or "/"
+        self.directory = self.origin + self.path[:self.path.rfind("/") + 1]
+
+    def resolve(self, href):
+        if href.startswith("//"):
+            if href[2:3] not in ("", "/", "?", "#"):
+                return f"{self.scheme}:{href}"
+        elif href.startswith("/"):
+            return self.origin + href
+        elif href.startswith("?"):
+            if href[1:2] not in ("", "#"):
+                return self.origin + self.path + href
+        else:
+            match = _SCHEME.match(href)
+            if not match:
+                return self.directory + href
+            if match.group(1).lower() not in _DEFAULT_PORTS:
+                return None
+            if href.startswith("//", match.end()):
+                return href
+        # Empty hosts and queries, or "http:page.html", where urljoin's
+        # answer is not a plain concatenation
+        return urljoin(self.url, href)
+
+
+class URLCanonicalizer:
+    """Reduce equivalent spellings of a URL to one canonical form
+
+    Lowercases scheme and host, drops default ports, fragments, path session
+    ids and tracking parameters, resolves dot segments, folds directory index
+    documents onto their directory, normalizes percent-encoding and sorts
+    the query string.
+    """
+
+    def __init__(self, allow_params=None, deny_params=DEFAULT_DENY_PARAMS, index_names=DEFAULT_INDEX_NAMES):
+        self.allow_params = [p.lower() for p in allow_params or ()]
+        self.deny_params = [p.lower() for p in deny_params or ()]
+        self.index_names = set(index_names or ())
+
+    def canonicalize(self, url):
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+
+        host = (parts.hostname or "").rstrip(".")
+        netloc = host
+        if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+            netloc = f"{host}:{parts.port}"
+        if parts.username:
+            credentials = parts.username + (f":{parts.password}" if parts.password else "")
+            netloc = f"{credentials}@{netloc}"
+
+        return urlunsplit(
+            (scheme, netloc, self._path(parts.path), self._query(parts.query), "")
+        )
+
+    def _path(self, path):
+        path = _PATH_SESSION.sub("", path)
+
+        # Resolve "." and ".." segments and collapse repeated slashes
+        segments = []
+        for segment in path.split("/"):
+            if segment in ("", "."):
+                continue
+            if segment == "..":
+                if segments:
+                    segments.pop()
+                continue
+            segments.append(quote(unquote(segment), safe=_PATH_SAFE))
+
+        trailing_slash = path.endswith(("/", "/.", "/..")) or not segments
+        if segments and segments[-1].lower() in self.index_names:
+            segments.pop()
+            trailing_slash = True
+
+        normalized = "/" + "/".join(segments)
+        if trailing_slash and segments:
+            normalized += "/"
+        return normalized
+
+    def _query(self, query):
+        if not query:
+            return ""
+        params = [
+            (key, value)
+            for key, value in parse_qsl(query, keep_blank_values=True)
+            if self._keep_param(key.lower())
+        ]
+        return urlencode(sorted(params))
+
+    def _keep_param(self, key):
+        if self.allow_params and not any(fnmatchcase(key, p) for p in self.allow_params):
+            return False
+        return not any(fnmatchcase(key, p) for p in self.deny_params)
+
+
+class TrapDetector:
+    """Throttle URL patterns that expand without bound (calendars, pagination, loops)
+
+    A URL is rejected when its path is deeper than ``max_path_depth``, repeats
+    a segment more than ``max_repeated_segments`` times (``/a/b/a/b/a/b``), or
+    when more than ``max_variants`` URLs share its template: the host and
+    path with digit runs replaced by ``{n}`` plus the sorted query keys.
+    """
+
+    def __init__(self, max_variants=500, max_repeated_segments=2, max_path_depth=16):
+        self.logger = Logger(__name__)
+        self.max_variants = max_variants
+        self.max_repeated_segments = max_repeated_segments
+        self.max_path_depth = max_path_depth
+        self._variants = Counter()
+        self._reported = set()
+
+    def allow(self, url):
+        """Check a new URL, counting it against its template"""
+        parts = urlsplit(url)
+        segments = [s for s in parts.path.split("/") if s]
+
+        if self.max_path_depth and len(segments) > self.max_path_depth:
+            self.logger.debug("Skipping %s: path too deep", url)
+            return False
+
+        if self.max_repeated_segments and segments:
+            if Counter(segments).most_common(1)[0][1] > self.max_repeated_segments:
+                self.logger.debug("Skipping %s: repeated path segments", url)
+                return False
+
+        if self.max_variants:
+            keys = sorted({key for key, _ in parse_qsl(parts.query, keep_blank_values=True)})
+            template = f"{parts.netloc}{_DIGITS.sub('{n}', parts.path)}?{'&'.join(keys)}"
+            self._variants[template] += 1
+            if self._variants[template] > self.max_variants:
+                self._report(template, f"more than {self.max_variants} variants")
+                return False
+
+        return True
+
+    def _report(self, key, reason):
+        """Log each throttled template once rather than for every rejected URL"""
+        if key not in self._reported:
+            self._reported.add(key)
+            self.logger.warning("Possible crawler trap, throttling %s: %s", key, reason)
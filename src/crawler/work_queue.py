@@ -0,0 +1,363 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from crawler.frontier import fingerprint
+from utils.logger import Logger
+
+try:
+    import redis
+except ImportError:  # Optional: only needed for redis:// work queues
+    redis = None
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def open_work_queue(spec, worker_index=0, worker_count=1, lease_seconds=600, max_attempts=5):
+    """Open a shared work queue from a SQLite path or a redis:// URL"""
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisWorkQueue(spec, worker_index, worker_count, lease_seconds, max_attempts)
+    return SQLiteWorkQueue(spec, worker_index, worker_count, lease_seconds, max_attempts)
+
+
+class SQLiteWorkQueue:
+    """Lease-based crawl queue shared by worker processes through one SQLite file
+
+    Every URL is stored once with its depth and a shard derived from its
+    fingerprint. Workers lease batches of URLs, preferring the shards they
+    own (``shard % worker_count == worker_index``) and stealing from other
+    shards when theirs run dry. A lease that is not completed within
+    ``lease_seconds`` (the worker crashed or stalled) expires and the URL
+    is handed out again, so every URL is processed at least once. URLs
+    leased ``max_attempts`` times without completing are given up on.
+
+    SQLite locking needs a local filesystem; workers on other machines
+    should use the Redis queue.
+    """
+
+    QUEUED, LEASED, DONE, FAILED = 0, 1, 2, 3
+
+    def __init__(self, path, worker_index=0, worker_count=1, lease_seconds=600, max_attempts=5):
+        self.logger = Logger(__name__)
+        self.worker_index = worker_index
+        self.worker_count = max(1, worker_count)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS work ("
+            "url TEXT PRIMARY KEY, depth INTEGER, shard INTEGER, state INTEGER DEFAULT 0, "
+            "lease_until REAL DEFAULT 0, owner TEXT, attempts INTEGER DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS work_state ON work (state, lease_until)")
+
+    def add_many(self, entries):
+        """Queue (url, depth) pairs, ignoring URLs already known"""
+        rows = [(url, depth, fingerprint(url) & 0x7FFFFFFF) for url, depth in entries]
+        if not rows:
+            return
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.executemany(
+                "INSERT OR IGNORE INTO work (url, depth, shard) VALUES (?, ?, ?)", rows
+            )
+            self._db.execute("COMMIT")
+
+    def known(self, url):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM work WHERE url = ?", (url,)).fetchone() is not None
+
+    def known_many(self, urls):
+        """The subset of urls already in the queue"""
+        known = set()
+        with self._lock:
+            for i in range(0, len(urls), 500):
+                chunk = urls[i:i + 500]
+                known.update(url for url, in self._db.execute(
+                    f"SELECT url FROM work WHERE url IN ({','.join('?' * len(chunk))})", chunk
+                ))
+        return known
+
+    def lease(self, owner, limit):
+        """Claim up to limit (url, depth) entries for owner"""
+        now = time.time()
+        ready = (
+            "(state = 0 OR (state = 1 AND lease_until < ?))"
+        )
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    f"SELECT rowid, url, depth, attempts FROM work WHERE {ready} "
+                    "AND shard % ? = ? ORDER BY rowid LIMIT ?",
+                    (now, self.worker_count, self.worker_index, limit),
+                ).fetchall()
+                if not rows:
+                    # Nothing left in our shards: help with the others
+                    rows = self._db.execute(
+                        f"SELECT rowid, url, depth, attempts FROM work WHERE {ready} "
+                        "ORDER BY rowid LIMIT ?",
+                        (now, limit),
+                    ).fetchall()
+
+                leased, failed = [], []
+                for rowid, url, depth, attempts in rows:
+                    if attempts >= self.max_attempts:
+                        failed.append((rowid,))
+                        self.logger.warning("Giving up on %s after %s leases", url, attempts)
+                    else:
+                        leased.append((rowid, url, depth))
+                self._db.executemany(
+                    f"UPDATE work SET state = {self.FAILED}, owner = NULL WHERE rowid = ?", failed
+                )
+                self._db.executemany(
+                    f"UPDATE work SET state = {self.LEASED}, lease_until = ?, owner = ?, "
+                    "attempts = attempts + 1 WHERE rowid = ?",
+                    [(now + self.lease_seconds, owner, rowid) for rowid, _, _ in leased],
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return [(url, depth) for _, url, depth in leased]
+
+    def complete(self, url):
+        with self._lock:
+            self._db.execute(
+                f"UPDATE work SET state = {self.DONE}, owner = NULL WHERE url = ?", (url,)
+            )
+
+    def remaining(self):
+        """Number of URLs queued or leased by any worker"""
+        with self._lock:
+            return self._db.execute(
+                f"SELECT COUNT(*) FROM work WHERE state IN ({self.QUEUED}, {self.LEASED})"
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# Atomically add a URL unless seen: KEYS seen, depths, queue, remaining; ARGV url, depth
+_REDIS_ADD = """
+if redis.call('SADD', KEYS[1], ARGV[1]) == 1 then
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+    redis.call('RPUSH', KEYS[3], ARGV[1])
+    redis.call('INCR', KEYS[4])
+end
+"""
+
+# Reclaim expired leases, then pop queued URLs, leasing each until ARGV expiry.
+# KEYS leases, attempts, remaining, queue...; ARGV now, expiry, limit, max_attempts
+_REDIS_LEASE = """
+local out = {}
+local limit = tonumber(ARGV[3])
+local function claim(url)
+    if redis.call('HINCRBY', KEYS[2], url, 1) > tonumber(ARGV[4]) then
+        redis.call('ZREM', KEYS[1], url)
+        redis.call('DECR', KEYS[3])
+    else
+        redis.call('ZADD', KEYS[1], ARGV[2], url)
+        table.insert(out, url)
+    end
+end
+for _, url in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, limit)) do
+    claim(url)
+end
+for i = 4, #KEYS do
+    while #out < limit do
+        local url = redis.call('LPOP', KEYS[i])
+        if not url then break end
+        claim(url)
+    end
+end
+return out
+"""
+
+# Finish a URL once, however many times it was leased: KEYS leases, remaining; ARGV url
+_REDIS_COMPLETE = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 1 then
+    redis.call('DECR', KEYS[2])
+end
+"""
+
+
+class RedisWorkQueue:
+    """Lease-based crawl queue in Redis, for workers spread over several machines
+
+    Same semantics as ``SQLiteWorkQueue``: one list per shard, a sorted set
+    of leases scored by expiry, and Lua scripts so that adding, leasing and
+    completing are each atomic. Requires the ``redis`` package.
+    """
+
+    # Shards URLs are spread over; workers own shard % worker_count == worker_index
+    SHARDS = 64
+
+    def __init__(self, url, worker_index=0, worker_count=1, lease_seconds=600, max_attempts=5,
+                 prefix="webtomd"):
+        if redis is None:
+            raise RuntimeError("Redis work queues need the redis package (pip install redis)")
+        self.logger = Logger(__name__)
+        self.worker_index = worker_index
+        self.worker_count = max(1, worker_count)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        self._redis = redis.Redis.from_url(url)
+        self._keys = {
+            name: f"{prefix}:{name}" for name in ("seen", "depths", "leases", "attempts", "remaining")
+        }
+        self._add = self._redis.register_script(_REDIS_ADD)
+        self._lease = self._redis.register_script(_REDIS_LEASE)
+        self._complete = self._redis.register_script(_REDIS_COMPLETE)
+
+        shards = [f"{prefix}:queue:{shard}" for shard in range(self.SHARDS)]
+        own = [key for shard, key in enumerate(shards) if shard % self.worker_count == self.worker_index]
+        # Own shards first, then the rest for work stealing
+        self._shard_keys = shards
+        self._lease_order = own + [key for key in shards if key not in own]
+
+    def add_many(self, entries):
+        keys = self._keys
+        with self._redis.pipeline(transaction=False) as pipe:
+            for url, depth in entries:
+                queue = self._shard_keys[fingerprint(url) % self.SHARDS]
+                self._add(
+                    keys=[keys["seen"], keys["depths"], queue, keys["remaining"]],
+                    args=[url, depth],
+                    client=pipe,
+                )
+            pipe.execute()
+
+    def known(self, url):
+        return bool(self._redis.sismember(self._keys["seen"], url))
+
+    def known_many(self, urls):
+        with self._redis.pipeline(transaction=False) as pipe:
+            for url in urls:
+                pipe.sismember(self._keys["seen"], url)
+            return {url for url, member in zip(urls, pipe.execute()) if member}
+
+    def lease(self, owner, limit):
+        now = time.time()
+        keys = self._keys
+        urls = self._lease(
+            keys=[keys["leases"], keys["attempts"], keys["remaining"]] + self._lease_order,
+            args=[now, now + self.lease_seconds, limit, self.max_attempts],
+        )
+        if not urls:
+            return []
+        depths = self._redis.hmget(keys["depths"], urls)
+        return [(url.decode("utf-8"), int(depth or 0)) for url, depth in zip(urls, depths)]
+
+    def complete(self, url):
+        self._complete(keys=[self._keys["leases"], self._keys["remaining"]], args=[url])
+
+    def remaining(self):
+        return int(self._redis.get(self._keys["remaining"]) or 0)
+
+    def close(self):
+        self._redis.close()
+
+
+class SharedFrontier:
+    """Frontier view of a shared work queue for one worker
+
+    Offers the ``Frontier`` interface to ``WebSpider``. URLs are leased in
+    batches, and discovered links are buffered and sent in one write. Both
+    are flushed before a URL is completed, so a page's links are never lost
+    once the page counts as done. ``len()`` counts work left anywhere in the
+    crawl, so a worker keeps polling while others still hold leases.
+    """
+
+    def __init__(self, queue, worker_id=None, batch_size=16, flush_size=256):
+        self.logger = Logger(__name__)
+        self.queue = queue
+        self.worker_id = worker_id or default_worker_id()
+        self.batch_size = batch_size
+        self.flush_size = flush_size
+
+        self._lock = threading.RLock()
+        self._leased = []
+        self._new = []
+        self._known = set()
+
+    def __len__(self):
+        with self._lock:
+            if self._leased:
+                return len(self._leased)
+            self._flush()
+            return self.queue.remaining()
+
+    def seen(self, url):
+        with self._lock:
+            if url in self._known:
+                return True
+            if self.queue.known(url):
+                self._known.add(url)
+                return True
+            return False
+
+    def filter_unseen(self, urls):
+        with self._lock:
+            urls = [url for url in urls if url not in self._known]
+            if not urls:
+                return []
+            known = self.queue.known_many(urls)
+            self._known.update(known)
+            return [url for url in urls if url not in known]
+
+    def mark_seen(self, url):
+        with self._lock:
+            if self.seen(url):
+                return False
+            self._known.add(url)
+            return True
+
+    def add(self, url, depth):
+        """Buffer a newly discovered URL for the shared queue"""
+        with self._lock:
+            if not self.mark_seen(url):
+                return False
+            self._new.append((url, depth))
+            if len(self._new) >= self.flush_size:
+                self._flush()
+            return True
+
+    def pop(self):
+        """Next leased (url, depth), or None while every remaining URL is leased elsewhere"""
+        with self._lock:
+            if not self._leased:
+                self._flush()
+                self._leased = self.queue.lease(self.worker_id, self.batch_size)
+                self._leased.reverse()
+            return self._leased.pop() if self._leased else None
+
+    def done(self, url):
+        """Complete a URL in the shared queue, after the links it led to"""
+        with self._lock:
+            self._flush()
+            self.queue.complete(url)
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self.queue.close()
+
+    def _flush(self):
+        if self._new:
+            self.queue.add_many(self._new)
+            self._new = []
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+
+from utils.logger import Logger
+
+
+class AssetStore:
+    """Content-addressed asset store with a persistent URL index
+
+    Files are named after the SHA-256 of their content and sharded by the
+    first two hex digits, e.g. ``assets/3f/3fa2...c1.png``. Identical bytes
+    served from different URLs are stored once. The URL -> digest index and
+    the set of stored digests live in SQLite next to the assets, so both
+    lookups are O(1) and survive across runs without touching the filesystem.
+
+    Given a packing ``sink``, new blobs are written into it under
+    ``assets/<path>`` instead of being kept as files. Workers of a
+    distributed crawl share the blobs but each keep their own index.
+    """
+
+    def __init__(self, assets_dir, sink=None, index_name=".index.sqlite"):
+        self.logger = Logger(__name__)
+        self.sink = sink
+        self.assets_dir = Path(assets_dir)
+        self.assets_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Every index write commits at once (cheap in WAL mode), so the
+        # write lock is never held between images
+        self._db = sqlite3.connect(
+            str(self.assets_dir / index_name), timeout=30, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, path TEXT, size INTEGER)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, digest TEXT)")
+        # Downloaded size of blobs that went through the image optimizer,
+        # whether or not it changed them
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS optimized (digest TEXT PRIMARY KEY, original_size INTEGER)"
+        )
+        # Blobs written into a sink that started over are no longer in it
+        if self.sink is not None and self.sink.restarted:
+            self._db.execute("DELETE FROM blobs")
+        self._db.commit()
+
+        # Digest -> relative path of every stored blob
+        self._blobs = dict(self._db.execute("SELECT digest, path FROM blobs"))
+
+    def lookup(self, url, optimized=False):
+        """Return the stored relative path for a URL, or None
+
+        With ``optimized`` set, blobs stored without going through the
+        image optimizer are not returned.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest FROM urls WHERE url = ? AND (? = 0 OR EXISTS ("
+                "SELECT 1 FROM optimized WHERE optimized.digest = urls.digest))",
+                (url, int(optimized)),
+            ).fetchone()
+            return self._blobs.get(row[0]) if row else None
+
+    def put_stream(self, url, chunks, ext):
+        """Stream chunks into the store and return (relative path, digest)"""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.assets_dir), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            return self._commit_blob(url, tmp_path, digest.hexdigest(), size, ext)
+        except BaseException:
+            self._discard(tmp_path)
+            raise
+
+    def put_bytes(self, url, data, ext, original_size=None):
+        """Store an in-memory blob and return (relative path, digest)
+
+        original_size records the size of the image the optimizer produced the
+        blob from, which it may have left as it was.
+        """
+        relative_path, digest = self.put_stream(url, (data,), ext)
+        if original_size is not None:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO optimized (digest, original_size) VALUES (?, ?)",
+                    (digest, original_size),
+                )
+                self._db.commit()
+        return relative_path, digest
+
+    def close(self):
+        """Commit pending index writes and close the index"""
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def _commit_blob(self, url, tmp_path, digest, size, ext):
+        """Move a finished temp file into place unless its content is already stored"""
+        with self._lock:
+            relative_path = self._blobs.get(digest)
+            if relative_path is None:
+                relative_path = f"{digest[:2]}/{digest}{ext}"
+                if self.sink is not None:
+                    with open(tmp_path, "rb") as f:
+                        self.sink.write_asset(f"assets/{relative_path}", f.read())
+                    self._discard(tmp_path)
+                else:
+                    final_path = self.assets_dir / relative_path
+                    final_path.parent.mkdir(exist_ok=True)
+                    # Atomic on POSIX and Windows: readers never see a partial file
+                    os.replace(tmp_path, final_path)
+                self._blobs[digest] = relative_path
+                self._db.execute(
+                    "INSERT OR REPLACE INTO blobs (digest, path, size) VALUES (?, ?, ?)",
+                    (digest, relative_path, size),
+                )
+            else:
+                self.logger.debug("Reusing stored copy of %s", url)
+                self._discard(tmp_path)
+
+            if url is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO urls (url, digest) VALUES (?, ?)",
+                    (url, digest),
+                )
+            self._db.commit()
+
+        return relative_path, digest
+
+    @staticmethod
+    def _discard(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
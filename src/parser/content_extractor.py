@@ -1,87 +1,99 @@
 import re
 
-from bs4 import BeautifulSoup
-from bs4.element import Comment
+from lxml import etree
 from readability.readability import Document
+
+from parser.dom import is_tree, parse_html
 from utils.logger import Logger
 
+# Tags that never carry page content
+_NOISE_TAGS = ("script", "style", "noscript", "meta", "iframe", "footer", "nav")
+
+# Attributes kept on the remaining tags
+_ALLOWED_ATTRS = {"href", "src", "alt", "title"}
+
+_HIDDEN_STYLE = re.compile(r"display:\s*none")
+
 
 class ContentExtractor:
     logger = Logger(__name__)
 
     @staticmethod
-    def get_main_content(html):
-        """Extract main content using readability algorithm"""
+    def get_main_content(doc):
+        """Extract main content using readability algorithm
+
+        Parsed trees need readability-lxml 0.8.4.1 or later; older releases
+        only take strings.
+        """
         try:
-            doc = Document(html)
-            return doc.summary()
+            return Document(doc).summary()
         except Exception as e:
-            ContentExtractor.logger.error(f"Error extracting main content: {e}")
+            ContentExtractor.logger.warning(
+                "Readability failed (%s: %s), keeping the whole cleaned page", type(e).__name__, e
+            )
             # Fallback to original HTML if readability fails
-            return html
+            if is_tree(doc):
+                return etree.tostring(doc, encoding="unicode", method="html")
+            return doc
 
     @staticmethod
-    def clean_html(html):
-        """Remove scripts, styles, comments and other noise"""
+    def clean_html(doc):
+        """Remove scripts, styles, comments and other noise
+
+        Accepts an HTML string or a parsed tree. Trees are cleaned in place
+        and returned, so the caller can keep working on the same parse.
+        """
         try:
-            soup = BeautifulSoup(html, "html.parser")
-
-            # Remove unwanted tags
-            for tag in soup(
-                ["script", "style", "noscript", "meta", "iframe", "footer", "nav"]
-            ):
-                tag.decompose()
-
-            # Remove comments
-            for comment in soup.find_all(
-                text=lambda text: isinstance(text, Comment)
-            ):
-                comment.extract()
-
-            # Remove hidden elements
-            for tag in soup.find_all(style=re.compile(r"display:\s*none")):
-                tag.decompose()
-
-            # Clean attributes from remaining tags
-            for tag in soup.find_all(True):
-                # Keep only essential attributes
-                allowed_attrs = {"href", "src", "alt", "title"}
-                attrs = dict(tag.attrs)
-                for attr in attrs:
-                    if attr not in allowed_attrs:
-                        del tag[attr]
-
-            return str(soup)
+            tree = doc if is_tree(doc) else parse_html(doc)
+
+            # Remove unwanted tags, comments and hidden elements
+            noise = [el for el in tree.iter(etree.Comment, *_NOISE_TAGS)]
+            noise.extend(
+                el
+                for el in tree.iter()
+                if el.get("style") and _HIDDEN_STYLE.search(el.get("style"))
+            )
+            for el in noise:
+                if el.getparent() is not None:
+                    el.drop_tree()
+
+            # Clean attributes from remaining tags, keeping only essential ones
+            for el in tree.iter(etree.Element):
+                attrib = el.attrib
+                for attr in [a for a in attrib if a not in _ALLOWED_ATTRS]:
+                    del attrib[attr]
+
+            return tree
 
         except Exception as e:
-            ContentExtractor.logger.error(f"Error cleaning HTML: {e}")
-            return html
+            ContentExtractor.logger.error("Error cleaning HTML: %s", e)
+            return doc
 
     @staticmethod
-    def extract_title(html):
+    def extract_title(doc):
         """Extract page title from HTML"""
         try:
-            soup = BeautifulSoup(html, "html.parser")
+            tree = doc if is_tree(doc) else parse_html(doc)
 
             # Try to get title from the title tag
-            title_tag = soup.find("title")
-            if title_tag and title_tag.string:
-                return title_tag.string.strip()
+            title_tag = tree.find(".//title")
+            if title_tag is not None and title_tag.text and title_tag.text.strip():
+                return title_tag.text.strip()
 
             # Fallback to h1 if no title tag
-            h1_tag = soup.find("h1")
-            if h1_tag and h1_tag.get_text():
-                return h1_tag.get_text().strip()
+            h1_tag = tree.find(".//h1")
+            if h1_tag is not None and h1_tag.text_content().strip():
+                return h1_tag.text_content().strip()
 
             # Final fallback - look for meta title
-            meta_title = soup.find("meta", {"name": "title"}) or soup.find(
-                "meta", {"property": "og:title"}
-            )
-            if meta_title and "content" in meta_title.attrs:
-                return meta_title["content"].strip()
+            meta_title = tree.find(".//meta[@name='title']")
+            if meta_title is None:
+                meta_title = tree.find(".//meta[@property='og:title']")
+            if meta_title is not None and meta_title.get("content") is not None:
+                return meta_title.get("content").strip()
 
             return None
 
         except Exception as e:
-            ContentExtractor.logger.error(f"Error extracting title: {e}")
+            ContentExtractor.logger.error("Error extracting title: %s", e)
             return None
@@ -0,0 +1,103 @@
+import hashlib
+import re
+
+from lxml import html as lxml_html
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# Words per shingle fed into the SimHash
+_SHINGLE_SIZE = 3
+
+
+def _hash64(value):
+    return int.from_bytes(
+        hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+def simhash(words):
+    """64-bit SimHash over word shingles"""
+    if len(words) < _SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {
+            " ".join(words[i:i + _SHINGLE_SIZE])
+            for i in range(len(words) - _SHINGLE_SIZE + 1)
+        }
+
+    counts = [0] * 64
+    for shingle in shingles:
+        h = _hash64(shingle)
+        for bit in range(64):
+            counts[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if counts[bit] > 0)
+
+
+def content_fingerprints(main_content):
+    """Exact hash and SimHash of the visible text of extracted main content"""
+    try:
+        text = lxml_html.fromstring(main_content).text_content()
+    except Exception:
+        text = main_content
+    words = _WORD.findall(text.lower())
+    if not words:
+        # Empty pages are never treated as duplicates of each other
+        return None, None
+    exact = hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest()
+    return exact, simhash(words)
+
+
+class DuplicateIndex:
+    """Finds pages whose main content was already seen, exactly or nearly
+
+    Exact duplicates are matched on a hash of the normalized text. Near
+    duplicates are SimHashes within ``max_distance`` differing bits; they are
+    found through an LSH index that splits each hash into ``max_distance + 1``
+    bands, so by the pigeonhole principle any match shares at least one band
+    exactly and only that bucket has to be compared.
+
+    A page that should be the canonical copy instead of the one it
+    duplicates takes over its entries through ``replace``.
+    """
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max(0, max_distance)
+        self._exact = {}
+        # Canonical URLs replaced by another, resolved when a match is returned
+        self._replaced = {}
+
+        bands = self.max_distance + 1 if self.max_distance else 0
+        self._bands = []
+        start = 0
+        for i in range(bands):
+            width = 64 // bands + (1 if i < 64 % bands else 0)
+            self._bands.append((start, (1 << width) - 1))
+            start += width
+        self._buckets = [{} for _ in self._bands]
+
+    def check(self, url, exact, fingerprint):
+        """Return (canonical_url, kind) if the content is a duplicate, else index it"""
+        if exact is None:
+            return None
+        if exact in self._exact:
+            return self._resolve(self._exact[exact]), "exact"
+
+        keys = [(fingerprint >> shift) & mask for shift, mask in self._bands]
+        for buckets, key in zip(self._buckets, keys):
+            for other, other_url in buckets.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return self._resolve(other_url), "near"
+
+        self._exact[exact] = url
+        for buckets, key in zip(self._buckets, keys):
+            buckets.setdefault(key, []).append((fingerprint, url))
+        return None
+
+    def replace(self, canonical_url, url):
+        """Make url the canonical copy of everything matching canonical_url"""
+        self._replaced[canonical_url] = url
+
+    def _resolve(self, url):
+        while url in self._replaced:
+            url = self._replaced[url]
+        return url
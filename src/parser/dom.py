@@ -0,0 +1,54 @@
+import codecs
+import re
+
+from lxml import html as lxml_html
+
+
+def parse_html(html):
+    """Parse an HTML document into an lxml tree"""
+    if isinstance(html, str):
+        try:
+            return lxml_html.document_fromstring(html)
+        except ValueError:
+            # lxml rejects str input carrying an XML encoding declaration
+            html = html.encode("utf-8")
+    return lxml_html.document_fromstring(html)
+
+
+def is_tree(doc):
+    """Check whether a document has already been parsed"""
+    return isinstance(doc, lxml_html.HtmlElement)
+
+
+# <meta charset="..."> or <meta http-equiv="Content-Type" content="...; charset=...">
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([A-Za-z0-9_.:-]+)""", re.I)
+
+# Bytes scanned for a <meta> charset declaration
+_SNIFF_BYTES = 4096
+
+
+def detect_charset(body, declared=None):
+    """Pick the charset of an HTML body: BOM, then HTTP header, then <meta>, then UTF-8"""
+    if body.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if body.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+
+    candidates = [declared]
+    match = _META_CHARSET.search(body[:_SNIFF_BYTES])
+    if match:
+        candidates.append(match.group(1).decode("ascii"))
+
+    for candidate in candidates:
+        if not candidate:
+            continue
+        try:
+            return codecs.lookup(candidate).name
+        except LookupError:
+            continue
+    return "utf-8"
+
+
+def decode_html(body, declared=None):
+    """Decode an HTML body once, replacing undecodable bytes"""
+    return body.decode(detect_charset(body, declared), errors="replace")
@@ -35,7 +35,7 @@ class HTML2Markdown:
             return markdown
 
         except Exception as e:
-            self.logger.error(f"Error converting HTML to Markdown: {e}")
+            self.logger.error("Error converting HTML to Markdown: %s", e)
             # Fallback to basic conversion without enhancements
             return self.converter.handle(html)
 
@@ -0,0 +1,144 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.logger import Logger
+
+try:
+    from PIL import Image, features
+except ImportError:  # Optional: only needed when optimize_images is on
+    Image = None
+
+# Formats passed through untouched: vector, icon and already-modern images
+_SKIP_EXTENSIONS = frozenset((".svg", ".svgz", ".ico", ".avif"))
+
+# Pillow format names of the images we re-encode, and their extensions
+_EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp", "GIF": ".gif", "BMP": ".bmp", "TIFF": ".tif"}
+
+
+def optimize_image(data, ext, max_width=None, max_height=None, target=None, quality=80, lossless=False):
+    """Shrink one image; returns (data, ext) of the smaller encoding, or None to keep the original
+
+    Images larger than max_width x max_height are scaled down. They are then
+    re-encoded as target ("webp" or "avif"), or in their own format: PNG
+    losslessly at maximum compression, JPEG at ``quality``. Animated images
+    are left alone. Runs in the optimizer's worker processes.
+    """
+    if ext in _SKIP_EXTENSIONS or data.lstrip()[:1] == b"<":
+        return None
+
+    image = Image.open(io.BytesIO(data))
+    source = image.format
+    if source not in _EXTENSIONS or getattr(image, "is_animated", False):
+        return None
+    image.load()
+
+    resized = False
+    if max_width or max_height:
+        bounds = (max_width or image.width, max_height or image.height)
+        if image.width > bounds[0] or image.height > bounds[1]:
+            image.thumbnail(bounds, Image.LANCZOS)
+            resized = True
+
+    out = io.BytesIO()
+    if target:
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or "A" in image.mode else "RGB")
+        if target == "webp":
+            image.save(out, "WEBP", quality=quality, lossless=lossless, method=6)
+        else:
+            image.save(out, "AVIF", quality=100 if lossless else quality)
+        new_ext = f".{target}"
+    elif source == "PNG":
+        image.save(out, "PNG", optimize=True)
+        new_ext = ".png"
+    elif source == "JPEG":
+        if image.mode not in ("RGB", "L", "CMYK"):
+            image = image.convert("RGB")
+        image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        new_ext = ".jpg"
+    elif resized:
+        image.save(out, source)
+        new_ext = _EXTENSIONS[source]
+    else:
+        return None
+
+    optimized = out.getvalue()
+    # A smaller original is kept unless its dimensions had to change
+    if len(optimized) >= len(data) and not resized:
+        return None
+    return optimized, new_ext
+
+
+class ImageOptimizer:
+    """Post-download image optimization in a pool of worker processes
+
+    ``optimize`` blocks only the calling image download thread while a
+    worker resizes and re-encodes, so crawling and conversion carry on.
+    Pillow is optional: without it, or when disabled, images are kept as
+    downloaded. Totals of original and optimized bytes are logged on close.
+    """
+
+    def __init__(self, enabled=False, max_width=None, max_height=None, target=None,
+                 quality=80, lossless=False, workers=None):
+        self.logger = Logger(__name__)
+        self.enabled = enabled
+        if enabled and Image is None:
+            self.logger.warning("optimize_images needs Pillow (pip install Pillow), keeping images as downloaded")
+            self.enabled = False
+
+        target = (target or "").lower() or None
+        if self.enabled and target and not features.check(target):
+            self.logger.warning("This Pillow build cannot write %s, keeping image formats", target)
+            target = None
+
+        self.options = (max_width, max_height, target, quality, lossless)
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+        self._lock = threading.Lock()
+
+        # Bytes before and after optimization, for the closing summary
+        self.images = 0
+        self.original_bytes = 0
+        self.optimized_bytes = 0
+
+    def optimize(self, data, ext):
+        """Return (data, ext) to store for an image, optimized when that helps"""
+        if not self.enabled or ext in _SKIP_EXTENSIONS:
+            return data, ext
+        try:
+            result = self._executor().submit(optimize_image, data, ext, *self.options).result()
+        except Exception as e:
+            self.logger.warning("Could not optimize image (%s bytes): %s", len(data), e)
+            result = None
+
+        optimized, new_ext = result or (data, ext)
+        with self._lock:
+            self.images += 1
+            self.original_bytes += len(data)
+            self.optimized_bytes += len(optimized)
+        if result:
+            self.logger.debug("Optimized image %s -> %s bytes (%s)", len(data), len(optimized), new_ext)
+        return optimized, new_ext
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self.images:
+            ratio = self.original_bytes / self.optimized_bytes if self.optimized_bytes else 0
+            self.logger.info(
+                "Optimized %s images: %.1f MB -> %.1f MB (%.1fx smaller)",
+                self.images, self.original_bytes / 1048576, self.optimized_bytes / 1048576, ratio
+            )
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # Spawned like the conversion pool: the crawl threads are running
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
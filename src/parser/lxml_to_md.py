@@ -0,0 +1,385 @@
+import re
+
+from lxml import etree
+
+from parser.dom import is_tree, parse_html
+from utils.logger import Logger
+
+# Text at the start of a line that Markdown would read as a list, heading or quote
+_ORDERED_START = re.compile(r"\A(\d+)\.(?=\s|$)")
+_SYMBOL_START = re.compile(r"\A([-+*#>])(?=\s|$)")
+
+# Elements whose contents never become Markdown
+_SKIP_TAGS = frozenset(("script", "style", "head", "template", "noscript"))
+
+# Elements that start and end a paragraph-like block
+_BLOCK_TAGS = frozenset((
+    "p", "div", "section", "article", "main", "header", "footer", "aside", "nav",
+    "figure", "figcaption", "address", "details", "summary", "form", "fieldset",
+    "center", "dl", "body", "html",
+))
+
+_HEADING_LEVELS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+
+_EMPHASIS = {"strong": "**", "b": "**", "em": "_", "i": "_", "del": "~~", "s": "~~", "strike": "~~"}
+
+_CODE_TAGS = frozenset(("code", "kbd", "samp", "tt"))
+
+_LANGUAGE_CLASS = re.compile(r"(?:lang|language)-([\w+#.-]+)")
+
+
+class _Writer:
+    """Markdown output buffer that owes line breaks and spaces until real text arrives
+
+    Blocks only request breaks and inline markers are held until content
+    follows them, so blank lines, indentation and emphasis come out clean
+    without any pass over the finished string.
+    """
+
+    __slots__ = (
+        "parts", "breaks", "break_depth", "space", "prefixes", "marker", "pending", "lists",
+        "started", "line_start",
+    )
+
+    def __init__(self):
+        self.parts = []
+        self.breaks = 0  # newlines owed before the next output
+        self.break_depth = None  # prefixes in force when the owed breaks were requested
+        self.space = False  # a space owed before the next inline output
+        self.prefixes = []  # line prefixes of enclosing quotes and list items
+        self.marker = None  # list marker replacing the innermost prefix on the next line
+        self.pending = []  # opening markers waiting for content
+        self.lists = 0  # depth of enclosing lists
+        self.started = False
+        self.line_start = True
+
+    def block(self, breaks=2):
+        if self.started:
+            if breaks > self.breaks:
+                self.breaks = breaks
+            self._hold_depth()
+        self.space = False
+
+    def line_break(self):
+        if self.started:
+            self.breaks = min(self.breaks + 1, 2)
+            self._hold_depth()
+        self.space = False
+
+    def _hold_depth(self):
+        # A blank line between a quote and what follows carries no ">"
+        if self.break_depth is None or len(self.prefixes) < self.break_depth:
+            self.break_depth = len(self.prefixes)
+
+    def _begin(self):
+        """Emit owed breaks, prefix and markers; True if a new line was started"""
+        parts = self.parts
+        if self.breaks:
+            parts.append("\n")
+            if self.breaks > 1:
+                parts.append("".join(self.prefixes[:self.break_depth]).rstrip() + "\n")
+            self.breaks = 0
+            self.break_depth = None
+            self.line_start = True
+
+        new_line = self.line_start
+        if new_line:
+            if self.marker is not None:
+                parts.append("".join(self.prefixes[:-1]) + self.marker)
+                self.marker = None
+            elif self.prefixes:
+                parts.append("".join(self.prefixes))
+            self.line_start = False
+        elif self.space:
+            parts.append(" ")
+        self.space = False
+
+        if self.pending:
+            for token in self.pending:
+                parts.append(token[0])
+                token[1] = True
+            self.pending.clear()
+            new_line = False
+        self.started = True
+        return new_line
+
+    def text(self, text):
+        words = text.split()
+        if not words:
+            self.space = True
+            return
+        if text[0].isspace():
+            self.space = True
+        out = " ".join(words)
+        if self._begin():
+            out = _SYMBOL_START.sub(r"\\\1", _ORDERED_START.sub(r"\1\\.", out, 1), 1)
+        self.parts.append(out)
+        self.space = text[-1].isspace()
+
+    def raw(self, markdown):
+        self._begin()
+        self.parts.append(markdown)
+
+    def open(self, marker):
+        """Hold an opening marker until content follows; returns its token"""
+        token = [marker, False]
+        self.pending.append(token)
+        return token
+
+    def close(self, token, marker):
+        """Close a marker, or drop both ends if nothing was written between them"""
+        if token[1]:
+            self.parts.append(marker)
+        elif token in self.pending:
+            self.pending.remove(token)
+
+    def code_block(self, code, language):
+        fence = "```"
+        while fence in code:
+            fence += "`"
+        self.block(2)
+        self._begin()
+        prefix = "".join(self.prefixes)
+        parts = self.parts
+        parts.append(fence + language)
+        for line in code.split("\n"):
+            parts.append("\n" + (prefix + line if line else prefix.rstrip()))
+        parts.append("\n" + prefix + fence)
+        self.block(2)
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+class LxmlMarkdown:
+    """Convert HTML to Markdown by walking its lxml tree in a single pass
+
+    A drop-in alternative to ``HTML2Markdown``: same constructor and
+    ``convert`` signature, but no SAX handler and no regex post-passes.
+    Code blocks are emitted as fences and tables as GitHub pipe tables.
+    """
+
+    def __init__(self, ignore_links=False, bypass_tables=False):
+        self.logger = Logger(__name__)
+        self.ignore_links = ignore_links
+        self.bypass_tables = bypass_tables
+
+    def convert(self, html):
+        """Convert an HTML string or parsed tree to Markdown"""
+        if not is_tree(html) and not html.strip():
+            return ""
+        tree = None
+        try:
+            tree = html if is_tree(html) else parse_html(html)
+            body = tree.find("body")
+            out = _Writer()
+            self._walk(body if body is not None else tree, out)
+            markdown = out.getvalue()
+            return markdown + "\n" if markdown else ""
+        except Exception as e:
+            self.logger.error("Error converting HTML to Markdown: %s", e)
+            # Fall back to the bare text rather than losing the page
+            return tree.text_content() if tree is not None else html
+
+    def _walk(self, root, out):
+        walker = etree.iterwalk(root, events=("start", "end"))
+        closers = []
+        for event, el in walker:
+            if event == "end":
+                closer = closers.pop()
+                if closer is not None:
+                    closer[0](*closer[1:])
+                if el.tail and el is not root:
+                    out.text(el.tail)
+                continue
+
+            tag = el.tag
+            if not isinstance(tag, str) or tag in _SKIP_TAGS:
+                walker.skip_subtree()
+                closers.append(None)
+                continue
+
+            closer = None
+            if tag in _BLOCK_TAGS:
+                out.block(2)
+                closer = (out.block, 2)
+            elif tag in _EMPHASIS:
+                marker = _EMPHASIS[tag]
+                closer = (out.close, out.open(marker), marker)
+            elif tag == "a":
+                href = el.get("href")
+                if href and not self.ignore_links:
+                    closer = self._link(el, href, out)
+                    if closer is None:
+                        walker.skip_subtree()
+                        closers.append(None)
+                        continue
+            elif tag == "li":
+                closer = self._list_item(el, out)
+            elif tag in ("ul", "ol"):
+                # Nested lists hug their parent item; top-level lists are paragraphs
+                out.block(1 if out.lists else 2)
+                out.lists += 1
+                closer = (self._end_list, out)
+            elif tag in _HEADING_LEVELS:
+                out.block(2)
+                token = out.open("#" * _HEADING_LEVELS[tag] + " ")
+                closer = (self._end_heading, out, token)
+            elif tag == "blockquote":
+                out.block(2)
+                out.prefixes.append("> ")
+                closer = (self._end_prefixed, out)
+            elif tag == "dt":
+                out.block(1)
+                closer = (out.block, 1)
+            elif tag == "dd":
+                out.block(1)
+                out.prefixes.append("    ")
+                out.marker = ":   "
+                closer = (self._end_prefixed, out, 1)
+            else:
+                if tag == "pre":
+                    self._pre(el, out)
+                elif tag in _CODE_TAGS:
+                    self._inline_code(el, out)
+                elif tag == "img":
+                    self._image(el, out)
+                elif tag == "br":
+                    out.line_break()
+                elif tag == "table":
+                    self._table(el, out)
+                elif tag == "hr":
+                    out.block(2)
+                    out.raw("* * *")
+                    out.block(2)
+                else:
+                    # Unknown or purely presentational inline element
+                    closers.append(None)
+                    if el.text:
+                        out.text(el.text)
+                    continue
+                walker.skip_subtree()
+                closers.append(None)
+                continue
+
+            closers.append(closer)
+            if el.text:
+                out.text(el.text)
+
+    def _link(self, el, href, out):
+        text = el.text_content()
+        if href == text.strip() and href.startswith(("http://", "https://", "mailto:")) and not len(el):
+            out.raw(f"<{href}>")
+            return None
+        title = el.get("title")
+        target = f'{href} "{title}"' if title else href
+        return (out.close, out.open("["), f"]({target})")
+
+    def _list_item(self, el, out):
+        parent = el.getparent()
+        if parent is not None and parent.tag == "ol":
+            try:
+                start = int(parent.get("start", 1))
+            except ValueError:
+                start = 1
+            position = 0
+            for sibling in el.itersiblings(preceding=True):
+                if sibling.tag == "li":
+                    position += 1
+            marker = f"{start + position}. "
+        else:
+            marker = "* "
+        out.block(1)
+        out.prefixes.append(" " * len(marker))
+        out.marker = marker
+        return (self._end_prefixed, out, 1)
+
+    @staticmethod
+    def _end_list(out):
+        out.lists -= 1
+        out.block(1 if out.lists else 2)
+
+    @staticmethod
+    def _end_prefixed(out, breaks=2):
+        out.prefixes.pop()
+        out.marker = None
+        out.block(breaks)
+
+    @staticmethod
+    def _end_heading(out, token):
+        out.close(token, "")
+        out.block(2)
+
+    def _pre(self, el, out):
+        code = el.text_content().strip("\n")
+        if not code.strip():
+            return
+        language = ""
+        for node in (el, el.find("code")):
+            if node is not None and node.get("class"):
+                match = _LANGUAGE_CLASS.search(node.get("class"))
+                if match:
+                    language = match.group(1)
+                    break
+        out.code_block(code, language)
+
+    def _inline_code(self, el, out):
+        code = " ".join(el.text_content().split())
+        if not code:
+            return
+        fence = "`"
+        while fence in code:
+            fence += "`"
+        padding = " " if code[0] == "`" or code[-1] == "`" else ""
+        out.raw(f"{fence}{padding}{code}{padding}{fence}")
+
+    def _image(self, el, out):
+        src = el.get("src")
+        if not src:
+            return
+        alt = " ".join((el.get("alt") or "").split()).replace("[", "\\[").replace("]", "\\]")
+        out.raw(f"![{alt}]({src})")
+
+    def _table(self, el, out):
+        if self.bypass_tables:
+            out.block(2)
+            out.raw(etree.tostring(el, encoding="unicode", method="html", with_tail=False))
+            out.block(2)
+            return
+
+        rows = []
+        for child in el:
+            if child.tag == "tr":
+                rows.append(self._row(child))
+            elif child.tag in ("thead", "tbody", "tfoot"):
+                rows.extend(self._row(tr) for tr in child if tr.tag == "tr")
+        rows = [row for row in rows if row]
+        if not rows:
+            return
+
+        width = max(len(row) for row in rows)
+        lines = []
+        for i, row in enumerate(rows):
+            row = row + [""] * (width - len(row))
+            lines.append("| " + " | ".join(row) + " |")
+            if i == 0:
+                lines.append("|" + " --- |" * width)
+
+        out.block(2)
+        prefix = "".join(out.prefixes)
+        out.raw(lines[0])
+        for line in lines[1:]:
+            out.parts.append("\n" + prefix + line)
+        out.block(2)
+
+    def _row(self, tr):
+        return [self._cell(cell) for cell in tr if cell.tag in ("td", "th")]
+
+    def _cell(self, cell):
+        if not len(cell):
+            text = " ".join((cell.text or "").split())
+        else:
+            writer = _Writer()
+            self._walk(cell, writer)
+            text = " ".join(writer.getvalue().split())
+        return text.replace("|", "\\|")
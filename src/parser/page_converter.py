@@ -0,0 +1,121 @@
+import time
+
+from parser.content_extractor import ContentExtractor
+from parser.dedup import content_fingerprints
+from parser.html_to_md import HTML2Markdown
+from parser.lxml_to_md import LxmlMarkdown
+from utils.logger import Logger, configure_worker_logging
+from utils.metrics import run_stage
+
+# Markdown engines selectable with the markdown_engine setting
+MARKDOWN_ENGINES = {
+    "html2text": HTML2Markdown,
+    "lxml": LxmlMarkdown,
+}
+
+
+class PageConverter:
+    """Turn a fetched HTML page into Markdown
+
+    Methods accepting ``timings`` add the seconds spent per stage (clean,
+    extract, convert) to that dict when one is given.
+    """
+
+    def __init__(self, ignore_links=False, bypass_tables=False, engine="html2text"):
+        self.logger = Logger(__name__)
+        if engine not in MARKDOWN_ENGINES:
+            self.logger.warning("Unknown markdown engine %r, using html2text", engine)
+            engine = "html2text"
+        self.md_converter = MARKDOWN_ENGINES[engine](ignore_links, bypass_tables)
+
+    def convert(self, html, tree=None, timings=None):
+        """Clean, extract and convert a page, reusing its parsed tree if given"""
+        title, main_content = self.extract(html, tree, timings)
+        return self.render(title, main_content, timings)
+
+    def extract(self, html, tree=None, timings=None):
+        """Clean a page and return its (title, main content HTML)"""
+        start = time.perf_counter()
+        cleaned = ContentExtractor.clean_html(tree if tree is not None else html)
+        cleaned_at = time.perf_counter()
+        main_content = ContentExtractor.get_main_content(cleaned)
+
+        # Extract title for the markdown file
+        title = ContentExtractor.extract_title(cleaned)
+
+        if timings is not None:
+            timings["clean"] = cleaned_at - start
+            timings["extract"] = time.perf_counter() - cleaned_at
+        return title, main_content
+
+    def render(self, title, main_content, timings=None):
+        """Convert extracted main content to Markdown"""
+        start = time.perf_counter()
+        markdown = self.md_converter.convert(main_content)
+
+        # Add title to markdown if available
+        if title:
+            markdown = f"# {title}\n\n{markdown}"
+
+        if timings is not None:
+            timings["convert"] = time.perf_counter() - start
+        return markdown
+
+    @staticmethod
+    def title_of(markdown):
+        """Title that render put on the first line, or None"""
+        if markdown.startswith("# "):
+            return markdown[2:].split("\n", 1)[0].strip()
+        return None
+
+
+# Converter owned by each pool worker process
+_worker_converter = None
+
+# Whether workers report stage timings, and the fraction of calls profiled
+_worker_metrics = False
+_worker_profile_rate = 0.0
+
+
+def init_worker(ignore_links=False, bypass_tables=False, engine="html2text", metrics=False, profile_rate=0.0,
+                logging_args=None):
+    """Process pool initializer that builds the worker's converter
+
+    ``logging_args`` from ``utils.logger.worker_logging`` send the worker's
+    log records to the parent's handlers.
+    """
+    global _worker_converter, _worker_metrics, _worker_profile_rate
+    if logging_args:
+        configure_worker_logging(*logging_args)
+    _worker_converter = PageConverter(ignore_links, bypass_tables, engine)
+    _worker_metrics = metrics
+    _worker_profile_rate = profile_rate
+
+
+def _extract_fingerprinted(html, timings=None):
+    title, main_content = _worker_converter.extract(html, timings=timings)
+    return (title, main_content) + content_fingerprints(main_content)
+
+
+def convert_page(html):
+    """Convert a page inside a pool worker; returns (markdown, stats)"""
+    return run_stage(
+        _worker_converter.convert, html,
+        collect=_worker_metrics, profile_rate=_worker_profile_rate
+    )
+
+
+def extract_page(html):
+    """Extract and fingerprint a page inside a pool worker; returns (fields, stats)"""
+    return run_stage(
+        _extract_fingerprinted, html,
+        collect=_worker_metrics, profile_rate=_worker_profile_rate
+    )
+
+
+def render_page(title, main_content):
+    """Render extracted content inside a pool worker; returns (markdown, stats)"""
+    return run_stage(
+        _worker_converter.render, title, main_content,
+        collect=_worker_metrics, profile_rate=_worker_profile_rate
+    )
@@ -1,116 +1,155 @@
-import hashlib
 import os
 import re
 from pathlib import Path
 import base64
 from urllib.parse import unquote, urlparse
 
-import requests
+from parser.asset_store import AssetStore
 from utils.file_io import ensure_directory
 from utils.logger import Logger
+from utils.transport import Transport
 
 
 class ResourceHandler:
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, cache=None, journal=None, transport=None, sink=None,
+                 index_name=".index.sqlite", optimizer=None, offline=False):
         self.output_dir = Path(output_dir)
         self.assets_dir = self.output_dir / "assets"
         self.logger = Logger(__name__)
 
         # Create assets directory if it doesn't exist
         ensure_directory(self.assets_dir)
+        # Packed output formats take the assets into the archive
+        self.store = AssetStore(
+            self.assets_dir, sink if sink and sink.packs_assets else None, index_name
+        )
 
-        # Keep track of downloaded resources
-        self.downloaded_resources = {}
+        # Keep track of downloaded resources, including those of a resumed crawl
+        self.journal = journal
+        self.downloaded_resources = dict(journal.assets) if journal else {}
 
-        # Configure request session
-        self.session = requests.Session()
-        self.session.headers.update({"User-Agent": "WebToMarkdown Resource Downloader"})
+        # Validator cache for conditional re-downloads (optional)
+        self.cache = cache
+
+        # Resizing and re-encoding of downloaded images (optional)
+        self.optimizer = optimizer
+
+        # Offline (re-conversion) images come from the store or stay remote
+        self.offline = offline
+
+        # Pooled session of the shared transport
+        self.transport = transport or Transport()
+        self.session = self.transport.session
 
     def download_image(self, image_url):
         """Download image to local assets directory and return relative path"""
         try:
-            # Handle base64 encoded images
-            if image_url.startswith("data:image/"):
-                return self._save_base64_image(image_url)
-
             # Check if already downloaded
             if image_url in self.downloaded_resources:
-                self.logger.debug(f"Using cached version of {image_url}")
+                self.logger.debug("Using cached version of %s", image_url)
                 return self.downloaded_resources[image_url]
 
-            # Create a sanitized filename
-            parsed_url = urlparse(image_url)
-            original_filename = os.path.basename(unquote(parsed_url.path))
-
-            # Handle filenames without extensions
-            name, ext = os.path.splitext(original_filename)
-            if not ext:
-                ext = self._guess_extension(image_url)
-
-            # Create a unique filename using hash if no name available
-            if not name:
-                name = hashlib.md5(image_url.encode()).hexdigest()[:10]
-
-            # Sanitize filename
-            clean_name = re.sub(r"[^\w\-.]", "_", f"{name}{ext}")
+            # Handle base64 encoded images
+            if image_url.startswith("data:image/"):
+                return self._save_base64_image(image_url)
 
-            # Handle duplicate filenames
-            final_filename = self._get_unique_filename(clean_name)
-            local_path = self.assets_dir / final_filename
+            # Reuse the copy stored by a previous run, revalidating it if
+            # possible; copies stored before the optimizer was enabled are
+            # downloaded again to be optimized, unless offline
+            optimizing = bool(self.optimizer and self.optimizer.enabled and not self.offline)
+            stored_path = self.store.lookup(image_url, optimized=optimizing)
+            if stored_path and (not self.cache or self.offline):
+                return self._remember(image_url, f"assets/{stored_path}")
+            if self.offline:
+                self.logger.debug("Not in the asset store, keeping remote %s", image_url)
+                return image_url
+            cached = self.cache.get(image_url) if self.cache and stored_path else None
+            headers = self.cache.conditional_headers(cached) if cached else None
 
             # Download the image
-            self.logger.info(f"Downloading image: {image_url}")
-            response = self.session.get(image_url, timeout=30, stream=True)
+            self.logger.info("Downloading image: %s", image_url)
+            response = self.transport.get(image_url, stream=True, headers=headers)
+            if response.status_code == 304 and cached:
+                response.close()
+                self.logger.debug("Not modified: %s", image_url)
+                return self._remember(image_url, f"assets/{stored_path}")
             response.raise_for_status()
 
             # Check content type to verify it's an image
             content_type = response.headers.get("Content-Type", "")
             if not content_type.startswith("image/"):
                 self.logger.warning(
-                    f"URL {image_url} is not an image (Content-Type: {content_type})"
+                    "URL %s is not an image (Content-Type: %s)", image_url, content_type
                 )
 
-            # Save image content
-            with open(local_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            # Stream into the content-addressed store
+            stored_path, digest = self._store(
+                image_url, response.iter_content(chunk_size=8192), self._extension(image_url)
+            )
 
             # Store relative path for use in markdown (relative to output root)
-            relative_path = f"assets/{final_filename}"
-            self.downloaded_resources[image_url] = relative_path
+            relative_path = self._remember(image_url, f"assets/{stored_path}")
+            if self.cache:
+                self.cache.store(
+                    image_url,
+                    response.headers,
+                    digest,
+                    local_path=relative_path,
+                    complete=True,
+                )
 
             return relative_path
 
         except Exception as e:
-            self.logger.error(f"Failed to download {image_url}: {e}")
+            self.logger.error("Failed to download %s: %s", image_url, e)
             return image_url  # Return original URL on failure
 
-    def _save_base64_image(self, image_data):
+    def _save_base64_image(self, data_url):
         """Save base64 encoded image to local assets directory and return relative path"""
         try:
             # Extract image type and base64 data
-            header, encoded = image_data.split(",", 1)
-            file_ext = header.split(";")[0].split("/")[1]
+            header, encoded = data_url.split(",", 1)
+            file_ext = re.sub(r"[^\w]", "", header.split(";")[0].split("/")[1])
             image_data = base64.b64decode(encoded)
 
-            # Create a unique filename
-            name = hashlib.md5(image_data).hexdigest()[:10]
-            filename = f"{name}.{file_ext}"
-            local_path = self.assets_dir / filename
-
-            # Save image content
-            with open(local_path, "wb") as f:
-                f.write(image_data)
+            # Identical inline images collapse onto one stored file
+            stored_path, _ = self._store(None, (image_data,), f".{file_ext.lower()}")
 
             # Store relative path for use in markdown (relative to output root)
-            relative_path = f"assets/{filename}"
-            self.downloaded_resources[image_data] = relative_path
-
-            return relative_path
+            return self._remember(data_url, f"assets/{stored_path}", journal=False)
 
         except Exception as e:
-            self.logger.error(f"Failed to save base64 image: {e}")
-            return image_data  # Return original data URL on failure
+            self.logger.error("Failed to save base64 image: %s", e)
+            return data_url  # Return original data URL on failure
+
+    def _store(self, image_url, chunks, ext):
+        """Store an image, optimized first when an optimizer is enabled"""
+        if not self.optimizer or not self.optimizer.enabled:
+            return self.store.put_stream(image_url, chunks, ext)
+
+        data = b"".join(chunks)
+        optimized, optimized_ext = self.optimizer.optimize(data, ext)
+        if optimized is data:
+            return self.store.put_bytes(image_url, data, ext, original_size=len(data))
+        return self.store.put_bytes(image_url, optimized, optimized_ext, original_size=len(data))
+
+    def _remember(self, image_url, relative_path, journal=True):
+        """Record where an image was stored and return the path"""
+        self.downloaded_resources[image_url] = relative_path
+        if journal and self.journal:
+            self.journal.record_asset(image_url, relative_path)
+        return relative_path
+
+    def close(self):
+        """Flush the asset index"""
+        self.store.close()
+
+    def _extension(self, url):
+        """File extension for a URL, guessed when the path has none"""
+        ext = os.path.splitext(unquote(urlparse(url).path))[1].lower()
+        if re.fullmatch(r"\.[a-z0-9]{1,5}", ext):
+            return ext
+        return self._guess_extension(url)
 
     def _guess_extension(self, url):
         """Try to guess file extension from URL or default to .jpg"""
@@ -119,15 +158,3 @@ class ResourceHandler:
             if ext in url.lower():
                 return ext
         return ".jpg"  # Default extension
-
-    def _get_unique_filename(self, filename):
-        """Ensure filename is unique by adding a counter if needed"""
-        new_name = filename
-        counter = 1
-
-        while (self.assets_dir / new_name).exists():
-            name, ext = os.path.splitext(filename)
-            new_name = f"{name}_{counter}{ext}"
-            counter += 1
-
-        return new_name
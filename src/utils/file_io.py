@@ -14,7 +14,7 @@ def ensure_directory(path):
         Path(path).mkdir(parents=True, exist_ok=True)
         return True
     except Exception as e:
-        logger.error(f"Error creating directory {path}: {e}")
+        logger.error("Error creating directory %s: %s", path, e)
         return False
 
 
@@ -25,7 +25,7 @@ def write_file(path, content, mode="w", encoding="utf-8"):
             f.write(content)
         return True
     except Exception as e:
-        logger.error(f"Error writing to {path}: {e}")
+        logger.error("Error writing to %s: %s", path, e)
         return False
 
 
@@ -35,7 +35,7 @@ def read_file(path, mode="r", encoding="utf-8"):
         with open(path, mode, encoding=encoding) as f:
             return f.read()
     except Exception as e:
-        logger.error(f"Error reading {path}: {e}")
+        logger.error("Error reading %s: %s", path, e)
         return None
 
 
@@ -46,7 +46,7 @@ def save_json(path, data, indent=2):
             json.dump(data, f, ensure_ascii=False, indent=indent)
         return True
     except Exception as e:
-        logger.error(f"Error saving JSON to {path}: {e}")
+        logger.error("Error saving JSON to %s: %s", path, e)
         return False
 
 
@@ -56,7 +56,7 @@ def load_json(path):
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception as e:
-        logger.error(f"Error loading JSON from {path}: {e}")
+        logger.error("Error loading JSON from %s: %s", path, e)
         return None
 
 
@@ -66,7 +66,7 @@ def copy_file(src, dest):
         shutil.copy2(src, dest)
         return True
     except Exception as e:
-        logger.error(f"Error copying {src} to {dest}: {e}")
+        logger.error("Error copying %s to %s: %s", src, dest, e)
         return False
 
 
@@ -1,35 +1,245 @@
+import atexit
+import json
 import logging
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# The queue listener of the current configuration, stopped at exit, the
+# rate limit of INFO and DEBUG messages, or None, and the level of every
+# Logger created; other libraries' loggers stay at WARNING
+_configured = False
+_listener = None
+_rate_limit = None
+_level = logging.INFO
+_names = set()
+_lock = threading.Lock()
+
+# Listener of the queue pool worker processes log through
+_worker_listener = None
+
 
 class Logger:
-    def __init__(self, name: str, log_file: str = None):
+    """A named logger; handlers are set up once per process by configure_logging
+
+    Messages take ``%``-style arguments, e.g. ``logger.info("Saved to %s", path)``,
+    so nothing is formatted for disabled levels, and formatting of the rest
+    happens on the listener thread. INFO and DEBUG lines over the rate limit
+    are dropped before a log record is even created.
+    """
+
+    def __init__(self, name: str):
+        configure_logging(default=True)
         self.logger = logging.getLogger(name)
-        self.logger.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        with _lock:
+            _names.add(name)
+            self.logger.setLevel(_level)
+        # Bound methods of the standard logger, so these calls cost no extra frame
+        self.warning = self.logger.warning
+        self.error = self.logger.error
+        self.critical = self.logger.critical
+
+    def debug(self, message, *args):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self._log(logging.DEBUG, message, args)
+
+    def info(self, message, *args):
+        if self.logger.isEnabledFor(logging.INFO):
+            self._log(logging.INFO, message, args)
+
+    def _log(self, level, message, args):
+        suppressed = _rate_limit.check(self.logger.name, message) if _rate_limit else 0
+        if suppressed < 0:
+            return
+        extra = {"suppressed": suppressed} if suppressed else None
+        self.logger.log(level, message, *args, extra=extra)
+
 
-        # Console handler
-        ch = logging.StreamHandler()
-        ch.setLevel(logging.DEBUG)
-        ch.setFormatter(formatter)
-        self.logger.addHandler(ch)
+def configure_logging(level="INFO", log_file=None, log_json=None, rate_limit=10, default=False):
+    """Route all logging through one queue to stderr and optional log files
 
-        # File handler
+    Records are queued by the calling thread and written by a single
+    listener thread, so terminal and file I/O stays off the crawl and
+    conversion paths. ``log_file`` gets the same text lines as stderr and
+    ``log_json`` one JSON object per line. ``rate_limit`` caps each INFO or
+    DEBUG message of a Logger (one call site) at that many lines per second,
+    0 for no limit; warnings and errors are never dropped. With
+    ``default`` set, an existing configuration is kept.
+    """
+    global _configured, _listener
+    with _lock:
+        if default and _configured:
+            return
+        if _listener is not None:
+            _listener.stop()
+
+        text = _TextFormatter(FORMAT)
+        handlers = [logging.StreamHandler(sys.stderr)]
         if log_file:
-            fh = logging.FileHandler(log_file)
-            fh.setLevel(logging.DEBUG)
-            fh.setFormatter(formatter)
-            self.logger.addHandler(fh)
+            handlers.append(_file_handler(log_file))
+        for handler in handlers:
+            handler.setFormatter(text)
+        if log_json:
+            handler = _file_handler(log_json)
+            handler.setFormatter(_JsonFormatter())
+            handlers.append(handler)
+
+        records = queue.SimpleQueue()
+        _install(_QueueHandler(records), level, rate_limit)
+        _listener = QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+        _configured = True
+
+
+def worker_logging():
+    """Arguments for configure_worker_logging in a pool worker process
+
+    Workers log through a multiprocessing queue into this process's
+    handlers, so their lines reach the same stderr and log files at the
+    same level and rate limit.
+    """
+    global _worker_listener
+    with _lock:
+        if _worker_listener is None:
+            records = multiprocessing.get_context("spawn").Queue()
+            _worker_listener = QueueListener(records, _Forward())
+            _worker_listener.start()
+        return _worker_listener.queue, _level, _rate_limit.limit if _rate_limit else 0
+
+
+def configure_worker_logging(records, level, rate_limit):
+    """Send a pool worker's logging to the parent process, see worker_logging"""
+    global _configured, _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+        _install(QueueHandler(records), level, rate_limit)
+        _configured = True
+
+
+def _install(queue_handler, level, rate_limit):
+    """Make queue_handler the root's only queue handler and apply the level and rate limit"""
+    global _rate_limit, _level
+    _rate_limit = _RateLimit(rate_limit) if rate_limit else None
+
+    # Neither format shows the caller or process, so records skip
+    # collecting them (the logging HOWTO's optimization switches)
+    logging._srcfile = None
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(logging.WARNING)
+    _level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    for name in _names:
+        logging.getLogger(name).setLevel(_level)
+
+
+def _file_handler(path):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    return logging.FileHandler(path, encoding="utf-8")
+
+
+@atexit.register
+def _stop_listener():
+    """Write out queued records, workers' first, before the process exits"""
+    global _listener, _worker_listener
+    with _lock:
+        if _worker_listener is not None:
+            _worker_listener.stop()
+            _worker_listener = None
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+class _QueueHandler(QueueHandler):
+    """Queue records as they are, leaving formatting to the listener thread
+
+    The queue never leaves the process, so records need not be made
+    picklable; arguments are formatted when the listener writes them.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class _Forward:
+    """Listener target passing worker records to their logger in this process
+
+    The workers already applied level and rate limit, so a record goes
+    straight to the handlers.
+    """
+
+    level = logging.NOTSET
+
+    def handle(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+class _RateLimit:
+    """At most ``limit`` lines per second of each message
+
+    A message is identified by its logger and unformatted text, i.e. its
+    call site, so "Crawling %s" is limited as a whole rather than per URL.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._windows = {}  # (logger, message) -> [second, lines, dropped]
+
+    def check(self, name, message):
+        """-1 to drop a line, else how many were dropped since the last one let through"""
+        key = (name, message)
+        second = int(time.monotonic())
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or window[0] != second:
+                self._windows[key] = [second, 1, 0]
+                return window[2] if window else 0
+            if window[1] < self.limit:
+                window[1] += 1
+                return 0
+            window[2] += 1
+            return -1
+
 
-    def debug(self, message: str):
-        self.logger.debug(message)
+class _TextFormatter(logging.Formatter):
+    """The usual text lines, noting how many similar lines the rate limit dropped"""
 
-    def info(self, message: str):
-        self.logger.info(message)
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line += f" ({suppressed} similar lines suppressed)"
+        return line
 
-    def warning(self, message: str):
-        self.logger.warning(message)
 
-    def error(self, message: str):
-        self.logger.error(message)
+class _JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and any exception"""
 
-    def critical(self, message: str):
-        self.logger.critical(message)
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
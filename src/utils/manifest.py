@@ -0,0 +1,241 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from utils.logger import Logger
+
+
+def content_hash(markdown):
+    """Hash of a page's Markdown as stored in the manifest"""
+    return hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+
+
+class OutputManifest:
+    """What each URL's output is, so runs only write, and report, what changed
+
+    ``pages(url, path, hash, changed_at, run)`` maps every URL of the mirror
+    to its output path, the hash of its Markdown and when that last changed;
+    duplicate pages are kept with a NULL path. ``run`` is the last run in
+    which the URL was still present: written, served unchanged from the
+    validator cache, or temporarily failing. Once a crawl completes, URLs
+    left behind by an earlier run are gone from the site and are pruned;
+    ``failures(run, url)`` lists the run's failed fetches, below which the
+    crawl could not see, so runs with any are not pruned.
+
+    Each run's additions, changes and removals are collected in ``changes``
+    and appended to a JSON Lines change feed when the run finishes, one
+    ``{"run", "event", "url", "path", "hash", "time"}`` object per line.
+    """
+
+    def __init__(self, path, feed_path=None, resume=False, output=None, restarted=False):
+        self.logger = Logger(__name__)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.feed_path = Path(feed_path) if feed_path else None
+
+        self._lock = threading.Lock()
+        # Written by the crawl thread (kept pages) and the main thread
+        # (output); every write commits at once, cheap in WAL mode, so the
+        # write lock is never held between pages
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                path TEXT,
+                hash TEXT,
+                changed_at REAL,
+                run INTEGER
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS pages_run ON pages (run)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, output TEXT, started REAL, finished REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS changes (run INTEGER, event TEXT, url TEXT, path TEXT, hash TEXT, at REAL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS failures (run INTEGER, url TEXT)")
+
+        # A resumed crawl continues the unfinished run, keeping what it saw;
+        # after a finished run there is nothing to resume
+        last = self._db.execute(
+            "SELECT run, output, finished FROM runs ORDER BY run DESC LIMIT 1"
+        ).fetchone()
+        self.last_finished = bool(last and last[2] is not None)
+        # Set when every page must be written again, since the output
+        # does not have them
+        self.reset = False
+        if resume and last and last[2] is None:
+            self.run = last[0]
+        else:
+            self.run = (last[0] if last else 0) + 1
+            self._db.execute(
+                "INSERT INTO runs (run, output, started) VALUES (?, ?, ?)",
+                (self.run, output, time.time())
+            )
+            # Pages recorded for another output format or location
+            if last and last[1] != output:
+                self.logger.info("Output changed from %s to %s, rewriting every page", last[1], output)
+                self.reset = True
+        # An output that started out empty, e.g. a new archive replacing
+        # one a crash left unreadable
+        if restarted and not self.reset and self._db.execute(
+            "SELECT 1 FROM pages WHERE hash IS NOT NULL LIMIT 1"
+        ).fetchone():
+            self.logger.warning("Output %s started over, rewriting every page", output)
+            self.reset = True
+        if self.reset:
+            self._db.execute("UPDATE pages SET hash = NULL")
+        self._db.commit()
+
+    def record(self, url, path, digest):
+        """Record a page's output; returns its event and the path it had before
+
+        The event is "added", "changed" or "unchanged", and the caller writes
+        the page only when it is not unchanged. A previous path that differs
+        from ``path`` is output the page no longer owns.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT path, hash FROM pages WHERE url = ?", (url,)).fetchone()
+            previous = row[0] if row else None
+            if previous == path and row[1] == digest:
+                self._db.execute("UPDATE pages SET run = ? WHERE url = ?", (self.run, url))
+                self._db.commit()
+                return "unchanged", previous
+
+            event = "changed" if previous else "added"
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages (url, path, hash, changed_at, run) VALUES (?, ?, ?, ?, ?)",
+                (url, path, digest, now, self.run),
+            )
+            self._change(event, url, path, digest, now)
+            self._db.commit()
+            return event, previous
+
+    def record_alias(self, url):
+        """Record a URL as a duplicate of another page; returns the path it no longer owns, or None"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT path, hash FROM pages WHERE url = ?", (url,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages (url, path, hash, changed_at, run) VALUES (?, NULL, NULL, ?, ?)",
+                (url, now, self.run),
+            )
+            # A page added earlier this run was never in the feed, so its
+            # addition is dropped rather than followed by a removal
+            if row and row[0] and not self._db.execute(
+                "DELETE FROM changes WHERE run = ? AND url = ? AND event = 'added'", (self.run, url)
+            ).rowcount:
+                self._change("removed", url, row[0], row[1], now)
+            self._db.commit()
+        return row[0] if row and row[0] else None
+
+    def keep(self, url, path=None, failed=False):
+        """Mark a URL's existing output as still current this run
+
+        URLs the manifest does not know yet (output from before it existed)
+        are added with ``path`` and no hash, so their next write counts as
+        a change and their removal can be pruned. ``failed`` records that
+        the URL could not be fetched.
+        """
+        with self._lock:
+            if failed:
+                self._db.execute("INSERT INTO failures (run, url) VALUES (?, ?)", (self.run, url))
+            cursor = self._db.execute("UPDATE pages SET run = ? WHERE url = ?", (self.run, url))
+            if not cursor.rowcount:
+                self._db.execute(
+                    "INSERT INTO pages (url, path, hash, changed_at, run) VALUES (?, ?, NULL, ?, ?)",
+                    (url, path, time.time(), self.run),
+                )
+            self._db.commit()
+
+    def urls(self):
+        """URLs that have their own output"""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT url FROM pages WHERE path IS NOT NULL")]
+
+    def path_in_use(self, path):
+        """Whether a page present in this run still writes to path"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM pages WHERE path = ? AND run = ? LIMIT 1", (path, self.run)
+            ).fetchone()
+        return row is not None
+
+    def failures(self):
+        """Number of failed fetches this run, and one of their URLs"""
+        with self._lock:
+            count, url = self._db.execute(
+                "SELECT COUNT(*), MIN(url) FROM failures WHERE run = ?", (self.run,)
+            ).fetchone()
+        return count, url
+
+    def prune(self):
+        """Forget URLs not present in this run; returns their (url, path) pairs
+
+        Only call this after a complete crawl without failures: anything not
+        reached counts as removed from the site.
+        """
+        now = time.time()
+        with self._lock:
+            stale = self._db.execute(
+                "SELECT url, path, hash FROM pages WHERE run < ?", (self.run,)
+            ).fetchall()
+            for url, path, digest in stale:
+                if path:
+                    self._change("removed", url, path, digest, now)
+            self._db.execute("DELETE FROM pages WHERE run < ?", (self.run,))
+            self._db.commit()
+        return [(url, path) for url, path, _ in stale]
+
+    def finish(self):
+        """Close the run and append its changes to the feed; returns event counts"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT event, url, path, hash, at FROM changes WHERE run = ? ORDER BY rowid",
+                (self.run,)
+            ).fetchall()
+            if self.feed_path and rows:
+                self.feed_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.feed_path, "a", encoding="utf-8") as f:
+                    for event, url, path, digest, at in rows:
+                        f.write(json.dumps(
+                            {"run": self.run, "event": event, "url": url, "path": path,
+                             "hash": digest, "time": at},
+                            ensure_ascii=False,
+                        ) + "\n")
+            self._db.execute("DELETE FROM changes WHERE run = ?", (self.run,))
+            self._db.execute("DELETE FROM failures WHERE run = ?", (self.run,))
+            self._db.execute("UPDATE runs SET finished = ? WHERE run = ?", (time.time(), self.run))
+            self._db.commit()
+
+        counts = {"added": 0, "changed": 0, "removed": 0}
+        for row in rows:
+            counts[row[0]] += 1
+        return counts
+
+    def flush(self):
+        """Commit pending writes"""
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+
+    def close(self):
+        """Commit pending writes and close the database"""
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def _change(self, event, url, path, digest, at):
+        self._db.execute(
+            "INSERT INTO changes (run, event, url, path, hash, at) VALUES (?, ?, ?, ?, ?, ?)",
+            (self.run, event, url, path, digest, at),
+        )
@@ -0,0 +1,247 @@
+import bisect
+import cProfile
+import heapq
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from utils.logger import Logger
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_NULL_TIMER = nullcontext()
+
+
+def run_stage(func, *args, collect=False, profile_rate=0.0):
+    """Call a conversion stage, returning (result, stats)
+
+    With ``collect`` unset this is a plain call and stats is None. Otherwise
+    ``func`` receives a ``timings`` dict to fill per sub-stage, and a
+    ``profile_rate`` fraction of calls also run under cProfile.
+    """
+    if not collect:
+        return func(*args), None
+
+    timings = {}
+    profiler = cProfile.Profile() if profile_rate and random.random() < profile_rate else None
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        result = func(*args, timings=timings)
+    finally:
+        if profiler:
+            profiler.disable()
+    stats = {"timings": timings, "seconds": time.perf_counter() - start, "profile": None}
+
+    if profiler:
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(30)
+        stats["profile"] = output.getvalue()
+    return result, stats
+
+
+class Histogram:
+    """Fixed-bucket latency histogram"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 6),
+            "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], self.counts)),
+        }
+
+
+class Metrics:
+    """Per-stage latency histograms, counters and slow-page profiles for a run
+
+    Stages are fetch, clean, extract, convert, image and write. When
+    disabled every method returns immediately, so instrumented code pays
+    one attribute check per call.
+    """
+
+    def __init__(self, enabled=True, progress_interval=10, profile_slowest=0):
+        self.logger = Logger(__name__)
+        self.enabled = enabled
+        self.progress_interval = progress_interval
+        self.profile_slowest = profile_slowest
+
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._profiles = []  # min-heap of (seconds, seq, url, stats)
+        self._profile_seq = 0
+        self._started = time.monotonic()
+        self._last_progress = self._started
+
+    @contextmanager
+    def _timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timer(self, stage):
+        """Context manager timing a block into a stage histogram"""
+        return self._timed(stage) if self.enabled else _NULL_TIMER
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, counter, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def record_stages(self, url, stats):
+        """Record the stats returned by run_stage for a page"""
+        if not self.enabled or stats is None:
+            return
+        for stage, seconds in stats["timings"].items():
+            self.observe(stage, seconds)
+        self.record_profile(url, stats["seconds"], stats["profile"])
+
+    def record_profile(self, url, seconds, stats):
+        """Keep a profile if it is among the slowest seen so far"""
+        if not self.enabled or not self.profile_slowest or stats is None:
+            return
+        with self._lock:
+            self._profile_seq += 1
+            entry = (seconds, self._profile_seq, url, stats)
+            if len(self._profiles) < self.profile_slowest:
+                heapq.heappush(self._profiles, entry)
+            elif seconds > self._profiles[0][0]:
+                heapq.heapreplace(self._profiles, entry)
+
+    def report_progress(self, force=False):
+        """Log a one-line summary at most every progress_interval seconds"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_progress < self.progress_interval:
+            return
+        self._last_progress = now
+
+        with self._lock:
+            counters = dict(self._counters)
+        elapsed = now - self._started
+        written = counters.get("pages_written", 0)
+        self.logger.info(
+            "Progress: %s pages written (%.1f/s), %s fetched, %s unchanged, %s images, "
+            "%.1f MiB, %s errors, %s retries",
+            written,
+            written / elapsed,
+            counters.get("pages_fetched", 0),
+            counters.get("not_modified", 0) + counters.get("unchanged", 0),
+            counters.get("images", 0),
+            counters.get("bytes_fetched", 0) / 1048576,
+            counters.get("errors", 0),
+            counters.get("retries", 0),
+        )
+
+    def summary(self):
+        with self._lock:
+            return {
+                "elapsed_seconds": round(time.monotonic() - self._started, 3),
+                "counters": dict(self._counters),
+                "stages": {name: h.to_dict() for name, h in self._histograms.items()},
+                "slowest_pages": [
+                    {"url": url, "seconds": round(seconds, 6)}
+                    for seconds, _, url, _ in sorted(self._profiles, reverse=True)
+                ],
+            }
+
+    def export(self, path):
+        """Write metrics as Prometheus text (.prom) or JSON, plus any kept profiles"""
+        if not self.enabled or not path:
+            return
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".prom":
+            content = self._prometheus()
+        else:
+            content = json.dumps(self.summary(), indent=2)
+
+        # Textfile collectors may read at any moment, so replace atomically
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        self._export_profiles(path.parent / "profiles")
+        self.logger.info("Metrics written to %s", path)
+
+    def _prometheus(self):
+        summary = self.summary()
+        lines = [
+            "# HELP webtomd_stage_seconds Time spent per pipeline stage.",
+            "# TYPE webtomd_stage_seconds histogram",
+        ]
+        for stage, histogram in sorted(summary["stages"].items()):
+            cumulative = 0
+            for bound, count in histogram["buckets"].items():
+                cumulative += count
+                lines.append(f'webtomd_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'webtomd_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'webtomd_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+        for name, value in sorted(summary["counters"].items()):
+            lines.append(f"# TYPE webtomd_{name}_total counter")
+            lines.append(f"webtomd_{name}_total {value}")
+        lines.append("# TYPE webtomd_run_seconds gauge")
+        lines.append(f"webtomd_run_seconds {summary['elapsed_seconds']}")
+        return "\n".join(lines) + "\n"
+
+    def _export_profiles(self, profile_dir):
+        with self._lock:
+            profiles = sorted(self._profiles, reverse=True)
+        if not profiles:
+            return
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        for rank, (seconds, _, url, stats) in enumerate(profiles, 1):
+            slug = re.sub(r"[^\w.-]+", "_", url)[-80:]
+            with open(profile_dir / f"{rank:02d}_{slug}.txt", "w", encoding="utf-8") as f:
+                f.write(f"{url}\n{seconds:.3f}s\n\n{stats}")
@@ -0,0 +1,322 @@
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import warnings
+import zipfile
+from pathlib import Path
+
+from utils.logger import Logger
+
+
+def create_sink(output_format, output_dir, output_path=None, shard_size=64 * 1024 * 1024, worker=None):
+    """Build the sink for an output format, defaulting its path inside output_dir
+
+    Workers of a distributed crawl pass their name: they share a SQLite
+    database, committing every page, but write their own shards and archives.
+    """
+    output_dir = Path(output_dir)
+    if output_format == "sqlite":
+        if worker:
+            return SQLiteSink(output_path or output_dir / "site.sqlite", commit_every=1)
+        return SQLiteSink(output_path or output_dir / "site.sqlite")
+    if output_format == "jsonl":
+        return JsonlSink(output_path or output_dir / "shards", shard_size, worker)
+    if output_format == "zip":
+        path = Path(output_path or output_dir / "site.zip")
+        if worker:
+            path = path.with_name(f"{path.stem}-{worker}{path.suffix}")
+        return ZipSink(path)
+    if output_format != "directory":
+        Logger(__name__).warning("Unknown output format %r, writing a directory", output_format)
+    return DirectorySink(output_dir)
+
+
+class OutputSink:
+    """Destination for converted pages and, when packed, their assets
+
+    Paths are relative to the archive root and use forward slashes, e.g.
+    ``guide/intro.md`` or ``assets/3f/3fa2...c1.png``. Sinks are shared with
+    the image download threads, so every write takes the sink's lock.
+    """
+
+    # Whether assets are written into the sink rather than left as files
+    packs_assets = True
+
+    # Whether the output started out empty, without what earlier runs wrote
+    restarted = False
+
+    def __init__(self):
+        self.logger = Logger(__name__)
+        self._lock = threading.Lock()
+
+    def write_page(self, url, path, title, markdown):
+        raise NotImplementedError
+
+    def write_asset(self, path, data):
+        raise NotImplementedError
+
+    def remove_page(self, url, path):
+        """Delete a page that is no longer part of the site"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Make everything written so far durable"""
+
+    def close(self):
+        self.flush()
+
+
+class DirectorySink(OutputSink):
+    """One Markdown file per page under the output directory, as before"""
+
+    packs_assets = False
+
+    def __init__(self, output_dir):
+        super().__init__()
+        self.output_dir = Path(output_dir)
+        self._dirs = set()
+
+    def write_page(self, url, path, title, markdown):
+        output_path = self.output_dir / path
+        try:
+            # Each directory is created once rather than once per page
+            if output_path.parent not in self._dirs:
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                self._dirs.add(output_path.parent)
+
+            # Written beside the old file and renamed over it, so readers
+            # never see a half-written page
+            temp_path = output_path.with_name(f".{output_path.name}.tmp")
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(markdown)
+            os.replace(temp_path, output_path)
+            return output_path
+
+        except Exception as e:
+            self.logger.error("Error saving markdown for %s: %s", url, e)
+            # Fallback to a safe filename
+            output_path = self.output_dir / f"page_{hash(url) % 10000}.md"
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(markdown)
+            return output_path
+
+    def write_asset(self, path, data):
+        # Assets already live as files in the asset store
+        pass
+
+    def remove_page(self, url, path):
+        try:
+            (self.output_dir / path).unlink(missing_ok=True)
+        except Exception as e:
+            self.logger.error("Error removing %s of %s: %s", path, url, e)
+
+
+class SQLiteSink(OutputSink):
+    """All pages and assets in one SQLite database, written in batched transactions
+
+    Pages go to ``pages(url, path, title, markdown, hash)`` and assets to
+    ``assets(path, data)``. Rewriting a URL or path replaces its row.
+    """
+
+    # Writes per transaction
+    COMMIT_EVERY = 500
+
+    def __init__(self, path, commit_every=COMMIT_EVERY):
+        super().__init__()
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self.restarted = not self.path.exists()
+        # Other workers may hold the write lock for a moment
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, path TEXT, title TEXT, markdown TEXT, hash TEXT)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS assets (path TEXT PRIMARY KEY, data BLOB)")
+        self._db.commit()
+
+    def write_page(self, url, path, title, markdown):
+        digest = hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+        self._write(
+            "INSERT OR REPLACE INTO pages (url, path, title, markdown, hash) VALUES (?, ?, ?, ?, ?)",
+            (url, path, title, markdown, digest),
+        )
+        return f"{self.path}:{path}"
+
+    def write_asset(self, path, data):
+        self._write(
+            "INSERT OR REPLACE INTO assets (path, data) VALUES (?, ?)", (path, sqlite3.Binary(data))
+        )
+
+    def remove_page(self, url, path):
+        self._write("DELETE FROM pages WHERE url = ? OR path = ?", (url, path))
+
+    def flush(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def _write(self, sql, params):
+        with self._lock:
+            self._db.execute(sql, params)
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._db.commit()
+                self._uncommitted = 0
+
+
+class JsonlSink(OutputSink):
+    """Size-rotated JSON Lines shards: pages-00000.jsonl, assets-00000.jsonl, ...
+
+    Each page is one ``{"url", "path", "title", "markdown", "hash"}`` line and
+    each asset one ``{"path", "data"}`` line with base64 data. A shard is
+    closed once it reaches ``shard_size`` bytes. Shards from earlier runs are
+    kept; numbering continues after the highest existing one, and later lines
+    supersede earlier ones for the same url or path. A removed page gets a
+    ``{"url", "path", "deleted": true}`` tombstone line. A named worker
+    writes its own series, e.g. pages-w0-00000.jsonl.
+    """
+
+    def __init__(self, directory, shard_size=64 * 1024 * 1024, worker=None):
+        super().__init__()
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+        self._shards = {
+            kind: _Shard(self.directory, f"{kind}-{worker}" if worker else kind)
+            for kind in ("pages", "assets")
+        }
+        self.restarted = not self._shards["pages"].index
+
+    def write_page(self, url, path, title, markdown):
+        digest = hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+        record = {"url": url, "path": path, "title": title, "markdown": markdown, "hash": digest}
+        return self._write("pages", record)
+
+    def write_asset(self, path, data):
+        self._write("assets", {"path": path, "data": base64.b64encode(data).decode("ascii")})
+
+    def remove_page(self, url, path):
+        # Shards are append-only: a tombstone supersedes the page's earlier lines
+        self._write("pages", {"url": url, "path": path, "deleted": True})
+
+    def flush(self):
+        with self._lock:
+            for shard in self._shards.values():
+                shard.flush()
+
+    def close(self):
+        with self._lock:
+            for shard in self._shards.values():
+                shard.close()
+
+    def _write(self, kind, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            shard = self._shards[kind]
+            if shard.size and shard.size + len(line) > self.shard_size:
+                shard.rotate()
+            return shard.write(line)
+
+
+class _Shard:
+    """The currently open file of one JSONL shard series"""
+
+    def __init__(self, directory, kind):
+        self.directory = directory
+        self.kind = kind
+        existing = sorted(directory.glob(f"{kind}-*.jsonl"))
+        self.index = int(existing[-1].stem.rsplit("-", 1)[1]) + 1 if existing else 0
+        self.path = None
+        self._file = None
+        self.size = 0
+
+    def write(self, line):
+        if self._file is None:
+            self.path = self.directory / f"{self.kind}-{self.index:05d}.jsonl"
+            self._file = open(self.path, "ab")
+            self.size = 0
+        self._file.write(line)
+        self.size += len(line)
+        return self.path
+
+    def rotate(self):
+        self.close()
+        self.index += 1
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ZipSink(OutputSink):
+    """A single zip archive written as a stream of entries
+
+    Pages are deflated; assets, which are already compressed formats, are
+    stored as-is. A zip's central directory is only written on close, so an
+    archive left by a crashed run is unreadable and is started over; a
+    complete one is appended to, and readers take the last entry of a name.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        mode = "w"
+        if self.path.exists():
+            if zipfile.is_zipfile(self.path):
+                mode = "a"
+            else:
+                self.logger.warning("%s is incomplete, starting a new archive", self.path)
+        self.restarted = mode == "w"
+        self._zip = zipfile.ZipFile(self.path, mode, compression=zipfile.ZIP_DEFLATED)
+
+    def write_page(self, url, path, title, markdown):
+        self._write(path, markdown, zipfile.ZIP_DEFLATED)
+        return f"{self.path}:{path}"
+
+    def write_asset(self, path, data):
+        self._write(path, data, zipfile.ZIP_STORED)
+
+    def remove_page(self, url, path):
+        # Entries cannot be deleted from an archive being appended to; the
+        # change feed still reports the removal
+        self.logger.debug("Keeping %s in %s: zip entries cannot be removed", path, self.path)
+
+    def _write(self, path, data, compress_type):
+        with self._lock, warnings.catch_warnings():
+            # Rewritten pages are appended under their existing name on purpose
+            warnings.simplefilter("ignore", UserWarning)
+            self._zip.writestr(path, data, compress_type=compress_type)
+
+    def flush(self):
+        with self._lock:
+            if self._zip is not None and self._zip.fp is not None:
+                self._zip.fp.flush()
+
+    def close(self):
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+                self._zip = None
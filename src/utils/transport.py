@@ -0,0 +1,142 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+from utils.logger import Logger
+from utils.metrics import Metrics
+
+DEFAULT_USER_AGENT = "WebToMarkdown Bot"
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _async_accept_encoding():
+    """Content codings aiohttp can decode with the installed packages"""
+    encodings = ["gzip", "deflate"]
+    try:
+        import brotli  # noqa: F401
+
+        encodings.append("br")
+    except ImportError:
+        pass
+    return ", ".join(encodings)
+
+
+class Transport:
+    """Shared HTTP transport used by the spider, robots.txt and resource downloads
+
+    Synchronous callers use ``session``, a pooled ``requests.Session`` with
+    urllib3 retries. The asynchronous spider opens an aiohttp session with
+    ``async_session`` and fetches through ``async_get``, which applies the
+    same retry policy. Both honor ``Retry-After``, advertise every content
+    coding they can decode and send one User-Agent.
+    """
+
+    def __init__(
+        self,
+        user_agent=None,
+        connect_timeout=10,
+        read_timeout=30,
+        max_retries=3,
+        backoff_factor=0.5,
+        pool_maxsize=16,
+        max_retry_after=120,
+        metrics=None,
+    ):
+        self.logger = Logger(__name__)
+        self.user_agent = user_agent or DEFAULT_USER_AGENT
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_retry_after = max_retry_after
+        self.metrics = metrics or Metrics(enabled=False)
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"User-Agent": self.user_agent, "Accept-Encoding": ACCEPT_ENCODING}
+        )
+
+    def get(self, url, **kwargs):
+        """Synchronous GET through the pooled session"""
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+        return self.session.get(url, **kwargs)
+
+    def async_session(self, concurrency, per_host_concurrency):
+        """Open an aiohttp session with keep-alive pools sized for the crawl"""
+        connector = aiohttp.TCPConnector(
+            limit=concurrency,
+            limit_per_host=per_host_concurrency,
+            ttl_dns_cache=300,
+        )
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=self.connect_timeout, sock_read=self.read_timeout
+        )
+        headers = {
+            "User-Agent": self.user_agent,
+            "Accept-Encoding": _async_accept_encoding(),
+        }
+        return aiohttp.ClientSession(
+            headers=headers, timeout=timeout, connector=connector
+        )
+
+    async def async_get(self, session, url, headers=None):
+        """GET with retries; use the returned response as an async context manager"""
+        attempt = 0
+        while True:
+            try:
+                response = await session.get(url, headers=headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                self.logger.debug("Retrying %s in %.1fs after %r", url, delay, e)
+            else:
+                if response.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                delay = self._retry_delay(attempt, response.headers.get("Retry-After"))
+                response.release()
+                self.logger.debug(
+                    "Retrying %s in %.1fs after status %s", url, delay, response.status
+                )
+            attempt += 1
+            self.metrics.inc("retries")
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt):
+        """Exponential backoff with jitter"""
+        return self.backoff_factor * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    def _retry_delay(self, attempt, retry_after):
+        """Delay before the next attempt, preferring the server's Retry-After"""
+        if retry_after:
+            try:
+                if retry_after.strip().isdigit():
+                    seconds = float(retry_after)
+                else:
+                    seconds = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                return min(max(seconds, 0), self.max_retry_after)
+            except (TypeError, ValueError):
+                pass
+        return self._backoff(attempt)
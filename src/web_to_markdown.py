@@ -1,120 +1,790 @@
 from config_loader import ConfigLoader
+from crawler.capture import CaptureStore
+from crawler.checkpoint import CrawlJournal
+from crawler.http_cache import ValidatorCache
+from crawler.robots_parser import RobotsCache
+from crawler.scheduler import CrawlScheduler
 from crawler.spider import WebSpider
-from parser.content_extractor import ContentExtractor
-from parser.html_to_md import HTML2Markdown
+from crawler.url_canon import DEFAULT_DENY_PARAMS, TrapDetector, URLCanonicalizer
+from crawler.work_queue import SharedFrontier, open_work_queue
+from parser.dedup import DuplicateIndex, content_fingerprints
+from parser.image_optimizer import ImageOptimizer
+from parser.page_converter import (
+    PageConverter, convert_page, extract_page, init_worker, render_page
+)
 from parser.resource_handler import ResourceHandler
-from utils.logger import Logger
+from utils.file_io import load_json, save_json
+from utils.logger import Logger, configure_logging, worker_logging
+from utils.manifest import OutputManifest, content_hash
+from utils.metrics import Metrics, run_stage
+from utils.output_sink import create_sink
+from utils.transport import Transport
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
+from urllib.parse import urljoin, urlparse
+import argparse
+import multiprocessing
+import os
 import re
 
+# Markdown image syntax
+IMAGE_PATTERN = re.compile(r'!\[(.*?)\]\((.*?)\)')
 
-class WebToMarkdown:
-    def __init__(self, config_path="config/default.yaml"):
-        self.config = ConfigLoader(config_path)
+
+class _PendingPage:
+    """A page in the conversion pool, the site it belongs to and its current stage"""
+
+    __slots__ = ('site', 'url', 'future', 'stage')
+
+    def __init__(self, site, url, future, stage):
+        self.site = site
+        self.url = url
+        self.future = future
+        self.stage = stage
+
+
+class _SharedResources:
+    """Logging, metrics, HTTP transport, robots.txt cache and image pools
+
+    One instance is shared by every site of a batch.
+    """
+
+    def __init__(self, config):
+        # Log handlers, level and rate limit, set up once for the process
+        configure_logging(
+            config.get('log_level', 'INFO'),
+            config.get('log_file'),
+            config.get('log_json'),
+            config.get('log_rate_limit', 10)
+        )
+
+        # Stage latencies, counters and sampled profiles; a no-op when disabled
+        self.metrics = Metrics(
+            config.get('metrics', False),
+            config.get('progress_interval', 10),
+            config.get('profile_slowest', 0)
+        )
+        self.profile_rate = config.get('profile_sample_rate', 0.05) if self.metrics.profile_slowest else 0.0
+
+        # One pooled HTTP transport shared by every component
+        self.transport = Transport(
+            config.get('user_agent'),
+            config.get('connect_timeout', 10),
+            config.get('read_timeout', 30),
+            config.get('max_retries', 3),
+            config.get('retry_backoff', 0.5),
+            config.get('pool_maxsize', 16),
+            metrics=self.metrics
+        )
+
+        # Parsed robots.txt per host, reused across sites and, on disk, across runs
+        self.robots_cache = RobotsCache(
+            config.get('robots_cache'),
+            config.get('robots_ttl', 86400),
+            transport=self.transport
+        )
+
+        # Images of a page are downloaded concurrently through the shared session
+        self.image_pool = ThreadPoolExecutor(
+            max_workers=config.get('image_workers', 8),
+            thread_name_prefix='images'
+        )
+
+        # Resizing and re-encoding of downloaded images in worker processes
+        self.image_optimizer = ImageOptimizer(
+            config.get('optimize_images', False),
+            config.get('image_max_width'),
+            config.get('image_max_height'),
+            config.get('image_format'),
+            config.get('image_quality', 80),
+            config.get('image_lossless', False),
+            config.get('image_optimize_workers')
+        )
+
+    def close(self, config):
+        self.image_pool.shutdown()
+        self.image_optimizer.close()
+        self.robots_cache.close()
+        self.metrics.report_progress(force=True)
+        self.metrics.export(config.get('metrics_export'))
+
+
+class _ConversionLoop:
+    """Convert crawled pages inline or through a process pool and hand them to their site
+
+    Pages arrive as (site, url, html, tree) so one loop can serve a single
+    site or every site of a batch; each site converts and writes its own
+    pages. Subclasses provide ``config``, ``logger``, ``metrics`` and
+    ``profile_rate``.
+    """
+
+    def _convert(self, pages):
+        """Crawl and convert, inline or through the conversion pool"""
+        workers = self.config.get('conversion_workers')
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        if workers < 1:
+            # Convert inline, reusing the tree the spider already parsed
+            for site, url, html, tree in pages:
+                site._convert_inline(url, html, tree)
+            return
+
+        self._run_pipeline(workers, pages)
+
+    def _run_pipeline(self, workers, pages):
+        """Fetch, convert in a process pool and write, with bounded in-flight pages"""
+        max_in_flight = self.config.get('conversion_queue_size') or workers * 4
+        ordered = self.config.get('ordered_output', False)
+        self.logger.info(
+            "Converting with %s worker processes (%s output)",
+            workers, 'ordered' if ordered else 'unordered'
+        )
+
+        # Workers are spawned rather than forked because the spider's
+        # event loop thread is already running when the pool starts
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(
+                self.config.get('ignore_links', False),
+                self.config.get('bypass_tables', False),
+                self.config.get('markdown_engine', 'html2text'),
+                self.metrics.enabled,
+                self.profile_rate,
+                worker_logging()
+            )
+        )
+        pending = deque()
+        try:
+            for site, url, html, _ in pages:
+                self.logger.info("Processing %s", url)
+                if site.dedup:
+                    # Extract first so duplicates are dropped before rendering
+                    pending.append(_PendingPage(site, url, pool.submit(extract_page, html), 'extract'))
+                else:
+                    pending.append(_PendingPage(site, url, pool.submit(convert_page, html), 'render'))
+
+                # Backpressure: stop pulling pages while the pool is saturated
+                self._collect(pool, pending, ordered, block=len(pending) >= max_in_flight)
+
+            while pending:
+                self._collect(pool, pending, ordered, block=True)
+        finally:
+            for page in pending:
+                page.future.cancel()
+            pool.shutdown()
+
+    def _collect(self, pool, pending, ordered, block):
+        """Advance finished conversions, waiting for at least one if block is set"""
+        if ordered:
+            while pending and (block or pending[0].future.done()):
+                if pending[0].site._advance(pool, pending[0]):
+                    pending.popleft()
+                    block = False
+            return
+
+        if block:
+            wait([page.future for page in pending], return_when=FIRST_COMPLETED)
+        for page in [page for page in pending if page.future.done()]:
+            if page.site._advance(pool, page):
+                pending.remove(page)
+
+
+class WebToMarkdown(_ConversionLoop):
+    def __init__(self, config_path="config/default.yaml", resume=False, overrides=None, shared=None,
+                 reconvert=False):
+        self.config = ConfigLoader(config_path, overrides)
         self.logger = Logger(__name__)
-        self.spider = WebSpider(
-            self.config.get('target_url'),
+        # Re-convert captured pages offline instead of crawling
+        self.reconvert = reconvert
+
+        # A batch passes in the resources its sites share
+        self.shared = shared or _SharedResources(self.config)
+        self.metrics = self.shared.metrics
+        self.profile_rate = self.shared.profile_rate
+        self.transport = self.shared.transport
+        self.image_pool = self.shared.image_pool
+
+        # In distributed mode the URL queue is shared with other workers
+        # and this worker's own state files carry its name
+        self.frontier = None
+        self.worker = None
+        if self.config.get('work_queue'):
+            self.worker = f"w{self.config.get('worker_index', 0)}"
+            if not reconvert:
+                self.frontier = self._open_shared_frontier()
+
+        # Validators from previous runs let unchanged pages and images be skipped
+        cache_db = self.config.get('cache_db')
+        self.cache = ValidatorCache(self._worker_path(cache_db)) if cache_db else None
+
+        # Fetched responses, replayed by --reconvert without touching the network
+        capture_path = self.config.get('capture')
+        self.capture = CaptureStore(self._worker_path(capture_path)) if capture_path else None
+
+        # Where pages (and, for packed formats, assets) are written
+        self.sink = create_sink(
+            self.config.get('output_format', 'directory'),
+            self.config.get('output_dir'),
+            self.config.get('output_path'),
+            self.config.get('shard_size', 64 * 1024 * 1024),
+            self.worker
+        )
+
+        # What every URL's output was last run, so unchanged pages are not
+        # rewritten and removed ones can be pruned. Turning the image
+        # optimizer on or off also changes the output: every page is
+        # rewritten, and images stored unoptimized are downloaded again
+        manifest_path = self.config.get('manifest')
+        change_feed = self.config.get('change_feed')
+        output = (
+            f"{self.config.get('output_format', 'directory')}:"
+            f"{self.config.get('output_path') or self.config.get('output_dir')}"
+        )
+        if self.shared.image_optimizer.enabled:
+            output += " (optimized images)"
+        self.manifest = OutputManifest(
+            self._worker_path(manifest_path),
+            self._worker_path(change_feed) if change_feed else None,
+            resume,
+            output,
+            self.sink.restarted
+        ) if manifest_path else None
+        if self.manifest and self.manifest.reset and self.cache:
+            # Pages and images answering 304 would not be written again
+            self.cache.invalidate()
+
+        # A journal left by a finished crawl lists every URL as done, so
+        # resuming it would fetch nothing, and the pages it lists are not
+        # in an output that started over; crawl the site again instead
+        if resume and self.manifest and self.manifest.last_finished:
+            self.logger.info("The last crawl finished, starting a new one instead of resuming")
+            resume = False
+        elif resume and self.manifest and self.manifest.reset:
+            self.logger.warning("The output no longer has the pages crawled so far, starting a new crawl")
+            resume = False
+
+        # Periodic checkpoints of crawl progress, restored with --resume; a
+        # shared queue keeps its own progress, so workers need none
+        checkpoint_path = self.config.get('checkpoint_path')
+        self.journal = CrawlJournal(
+            checkpoint_path,
+            self.config.get('checkpoint_interval', 5),
+            resume
+        ) if checkpoint_path and not self.worker and not reconvert else None
+
+        canonicalizer = URLCanonicalizer(
+            self.config.get('url_allow_params'),
+            self.config.get('url_deny_params', DEFAULT_DENY_PARAMS)
+        )
+        # Page URLs are canonical, so output paths are relative to the
+        # canonical target URL, as in the spider's scope check
+        self.base_url = canonicalizer.canonicalize(self.config.get('target_url'))
+
+        self.spider = None if reconvert else WebSpider(
+            self.base_url,
             self.config.get('max_depth', 5),
             self.config.get('delay', 1),
-            self.config.get('user_agent')
+            self.config.get('user_agent'),
+            self.config.get('concurrency', 16),
+            self.config.get('per_host_concurrency', 4),
+            self.config.get('frontier_memory_limit', 100000),
+            self.config.get('frontier_spill_path'),
+            cache=self.cache,
+            journal=self.journal,
+            transport=self.transport,
+            discovery=self.config.get('discovery', 'links'),
+            max_body_size=self.config.get('max_body_size', 10 * 1024 * 1024),
+            canonicalizer=canonicalizer,
+            trap_detector=TrapDetector(
+                self.config.get('trap_max_variants', 500),
+                self.config.get('trap_max_repeated_segments', 2),
+                self.config.get('trap_max_path_depth', 16)
+            ),
+            metrics=self.metrics,
+            frontier=self.frontier,
+            robots_cache=self.shared.robots_cache,
+            respect_crawl_delay=self.config.get('respect_crawl_delay', True),
+            max_crawl_delay=self.config.get('max_crawl_delay', 30),
+            on_keep=self._keep_output if self.manifest else None,
+            capture=self.capture
         )
-        self.md_converter = HTML2Markdown(
+        self.page_converter = PageConverter(
             self.config.get('ignore_links', False),
-            self.config.get('bypass_tables', False)
+            self.config.get('bypass_tables', False),
+            self.config.get('markdown_engine', 'html2text')
+        )
+        if self.journal:
+            # Pages must be durable before the journal records them as done
+            self.journal.before_flush = self._flush_output
+
+        self.res_handler = ResourceHandler(
+            self.config.get('output_dir'), self.cache, self.journal, self.transport, self.sink,
+            self._worker_path('.index.sqlite'),
+            self.shared.image_optimizer,
+            offline=reconvert
         )
-        self.res_handler = ResourceHandler(self.config.get('output_dir'))
+
+        # Pages whose content duplicates an earlier page are recorded as aliases
+        self.dedup = DuplicateIndex(
+            self.config.get('near_duplicate_distance', 3)
+        ) if self.config.get('dedupe', True) else None
+        self.aliases_path = Path(self.config.get('output_dir')) / self._worker_path('aliases.json')
+        self.aliases = (load_json(self.aliases_path) or {}) if self.aliases_path.exists() else {}
+        # The canonical page of a duplicate group does not depend on the
+        # order pages finish converting in: the last run's canonical wins,
+        # else the smallest URL. Pages that lost the role this run are
+        # not written.
+        self._previous_canonicals = frozenset(alias['canonical'] for alias in self.aliases.values())
+        self._demoted = set()
+
+    def _open_shared_frontier(self):
+        """Join the distributed crawl through its shared work queue"""
+        worker_index = self.config.get('worker_index', 0)
+        worker_count = self.config.get('worker_count', 1)
+        queue = open_work_queue(
+            self.config.get('work_queue'),
+            worker_index,
+            worker_count,
+            self.config.get('lease_seconds', 600),
+            self.config.get('max_lease_attempts', 5)
+        )
+        self.logger.info(
+            "Worker %s of %s using work queue %s",
+            worker_index + 1, worker_count, self.config.get('work_queue')
+        )
+        return SharedFrontier(queue, self.config.get('worker_id'), self.config.get('lease_batch', 16))
+
+    def _worker_path(self, path):
+        """Give a per-worker state file this worker's name in distributed mode"""
+        if not self.worker:
+            return path
+        path = Path(path)
+        return str(path.with_name(f"{path.stem}-{self.worker}{path.suffix}"))
 
     def run(self):
         """Main execution method that crawls, processes, and saves content"""
-        self.logger.info(f"Starting crawl of {self.config.get('target_url')}")
-        
-        for url, html in self.spider.crawl():
-            try:
-                self.logger.info(f"Processing {url}")
-                
-                # Clean and convert content
-                cleaned_html = ContentExtractor.clean_html(html)
-                main_content = ContentExtractor.get_main_content(cleaned_html)
-                
-                # Extract title for the markdown file
-                title = ContentExtractor.extract_title(cleaned_html)
-                
-                # Convert to markdown
-                markdown = self.md_converter.convert(main_content)
-                
-                # Add title to markdown if available
-                if title:
-                    markdown = f"# {title}\n\n{markdown}"
-                
-                # Handle images and other resources
-                final_md = self._replace_image_urls(markdown, url)
-                
-                # Save the processed markdown
-                output_path = self._save_markdown(url, final_md)
-                self.logger.info(f"Saved to {output_path}")
-                
-            except Exception as e:
-                self.logger.error(f"Error processing {url}: {e}")
+        if self.reconvert and not self.capture:
+            self.logger.error("Nothing to re-convert: set capture to record pages while crawling")
+            return
+        self.logger.info("Starting crawl of %s", self.config.get('target_url'))
+        try:
+            self._convert(
+                (self, url, html, tree) for url, html, tree in self.pages()
+            )
+            self.finish_output()
+        finally:
+            self.close()
+            self.shared.close(self.config)
+
+    def pages(self):
+        """Pages to convert as (url, html, tree): crawled, or replayed from the capture store"""
+        if not self.reconvert:
+            return self.spider.crawl()
+        self.logger.info("Re-converting %s captured pages from %s", self.capture.count(), self.capture.path)
+        if self.manifest:
+            missing = sum(1 for url in self.manifest.urls() if not self.capture.has(url))
+            if missing:
+                self.logger.warning(
+                    "%s pages of the output were never captured and keep their current output; "
+                    "crawl once with capture enabled to include them", missing
+                )
+        return ((url, html, None) for url, html in self.capture.replay())
+
+    def finish_output(self):
+        """After a complete crawl, prune pages that are gone and publish the change feed"""
+        if not self.manifest:
+            return
+        # A worker only sees part of the crawl, and a replay only what was
+        # captured, so neither can tell what is gone
+        if self.config.get('prune_removed', True) and not self.worker and not self.reconvert:
+            self._prune()
+        counts = self.manifest.finish()
+        self.logger.info(
+            "Output of run %s: %s added, %s changed, %s removed",
+            self.manifest.run, counts['added'], counts['changed'], counts['removed']
+        )
+
+    def _prune(self):
+        """Remove the output of pages gone from the site, unless the crawl may have missed them"""
+        if self.spider and not self.spider.completed:
+            self.logger.warning("Not pruning removed pages of %s: the crawl did not complete", self.spider.base_url)
+            return
+        if self.spider and self.spider.keep_errors:
+            self.logger.warning(
+                "Not pruning removed pages of %s: %s kept pages could not be recorded",
+                self.spider.base_url, self.spider.keep_errors
+            )
+            return
+        # Pages below a failed fetch were never reached, not removed
+        failures, example = self.manifest.failures()
+        if failures:
+            self.logger.warning(
+                "Not pruning removed pages of %s: %s URLs failed to fetch this run, e.g. %s",
+                self.config.get('target_url'), failures, example
+            )
+            return
+
+        for url, path in self.manifest.prune():
+            self.aliases.pop(url, None)
+            if self.capture:
+                self.capture.remove(url)
+            if path and not self.manifest.path_in_use(path):
+                self.logger.info("Removing %s: %s is no longer on the site", path, url)
+                self.sink.remove_page(url, path)
+
+    def close(self):
+        """Flush and close this site's cache, journal, manifest, capture, aliases, assets and output"""
+        if self.cache:
+            self.cache.close()
+        if self.capture:
+            self.capture.close()
+        if self.journal:
+            self.journal.close()
+        if self.manifest:
+            self.manifest.close()
+        if self.dedup:
+            save_json(self.aliases_path, self.aliases)
+        self.res_handler.close()
+        self.sink.close()
+
+    def _convert_inline(self, url, html, tree):
+        """Convert and write a page in this process"""
+        try:
+            self.logger.info("Processing %s", url)
+            (title, main_content), stats = self._run_stage(
+                self.page_converter.extract, html, tree
+            )
+            self.metrics.record_stages(url, stats)
+            if self.dedup and self._is_duplicate(url, *content_fingerprints(main_content)):
+                return
+            markdown, stats = self._run_stage(self.page_converter.render, title, main_content)
+            self.metrics.record_stages(url, stats)
+            self._write_page(url, markdown)
+        except Exception as e:
+            self.logger.error("Error processing %s: %s", url, e)
+            self.metrics.inc('errors')
+            if self.manifest:
+                self._keep_output(url)
+            self._mark_done(url)
+
+    def _run_stage(self, func, *args):
+        """Run an inline conversion stage, timing and sampling it if metrics are on"""
+        return run_stage(func, *args, collect=self.metrics.enabled, profile_rate=self.profile_rate)
+
+    def _advance(self, pool, page):
+        """Move a page to its next stage; returns True once it needs no more work"""
+        try:
+            result, stats = page.future.result()
+            self.metrics.record_stages(page.url, stats)
+            if page.stage == 'extract':
+                title, main_content, exact, fingerprint = result
+                if self._is_duplicate(page.url, exact, fingerprint):
+                    return True
+                page.future = pool.submit(render_page, title, main_content)
+                page.stage = 'render'
+                return False
+
+            self._write_page(page.url, result)
+        except Exception as e:
+            self.logger.error("Error processing %s: %s", page.url, e)
+            self.metrics.inc('errors')
+            if self.manifest:
+                self._keep_output(page.url)
+            self._mark_done(page.url)
+        return True
+
+    def _is_duplicate(self, url, exact, fingerprint):
+        """Record the page as an alias if its content was already converted"""
+        match = self.dedup.check(url, exact, fingerprint)
+        if not match:
+            return False
+
+        canonical, kind = match
+        self.metrics.inc('duplicates')
+        if self._canonical_rank(url) < self._canonical_rank(canonical):
+            # This page is the group's canonical copy; the one converted
+            # first becomes its alias
+            self.logger.info("Replacing %s: %s duplicate of %s", canonical, kind, url)
+            self.dedup.replace(canonical, url)
+            for alias in self.aliases.values():
+                if alias['canonical'] == canonical:
+                    alias.update(canonical=url, path=self._page_path(url))
+            self._demoted.add(canonical)
+            self._record_alias(canonical, url, kind)
+            return False
+
+        self.logger.info("Skipping %s: %s duplicate of %s", url, kind, canonical)
+        self._record_alias(url, canonical, kind)
+        if self.cache:
+            self.cache.mark_complete(url)
+        self._mark_done(url)
+        return True
+
+    def _canonical_rank(self, url):
+        """Sort key of a duplicate group's pages; the smallest is the canonical one"""
+        return url not in self._previous_canonicals, url
+
+    def _record_alias(self, url, canonical, kind):
+        self.aliases[url] = {
+            'canonical': canonical,
+            'path': self._page_path(canonical),
+            'kind': kind
+        }
+        if self.manifest:
+            # A page that became a duplicate no longer has its own file
+            self._release_path(url, self.manifest.record_alias(url))
+
+    def _write_page(self, url, markdown):
+        """Localize images and save a converted page"""
+        if url in self._demoted:
+            # Another page became the canonical copy while this one rendered
+            if self.cache:
+                self.cache.mark_complete(url)
+            self._mark_done(url)
+            return
+
+        # Handle images and other resources
+        final_md = self._replace_image_urls(markdown, url)
+
+        # Save the processed markdown
+        with self.metrics.timer('write'):
+            output_path = self._save_markdown(url, final_md)
+        if output_path is None:
+            self.logger.info("Unchanged: %s", url)
+            self.metrics.inc('pages_unchanged')
+        else:
+            self.logger.info("Saved to %s", output_path)
+            self.metrics.inc('pages_written')
+        self.aliases.pop(url, None)
+        self.metrics.report_progress()
+
+        # Only now may the next run skip this page on a 304
+        if self.cache:
+            self.cache.mark_complete(url)
+        self._mark_done(url)
+
+    def _keep_output(self, url, failed=False):
+        """Keep a page's earlier output, or its alias, as part of this run"""
+        self.manifest.keep(url, None if url in self.aliases else self._page_path(url), failed)
+
+    def _release_path(self, url, path):
+        """Remove output a URL no longer owns, unless another page now writes there"""
+        if path and not self.manifest.path_in_use(path):
+            self.sink.remove_page(url, path)
+
+    def _flush_output(self):
+        """Make written pages and the manifest durable"""
+        self.sink.flush()
+        if self.manifest:
+            self.manifest.flush()
+
+    def _mark_done(self, url):
+        """Journal a page as finished so a resumed crawl skips it"""
+        if self.journal:
+            self.journal.record_done(url)
+        if self.worker:
+            # The page must be durable before the shared queue forgets it
+            self.sink.flush()
+        if self.spider:
+            self.spider.frontier.done(url)
 
     def _replace_image_urls(self, markdown, base_url):
         """Replace image URLs in markdown with local paths"""
-        # Regular expression to find markdown image syntax
-        img_pattern = r'!\[(.*?)\]\((.*?)\)'
-        
+        # Collect every image on the page first so they download concurrently
+        sources = []
+        for match in IMAGE_PATTERN.finditer(markdown):
+            if match.group(2) not in sources:
+                sources.append(match.group(2))
+        if not sources:
+            return markdown
+
+        # Convert relative URLs to absolute
+        absolute_urls = [
+            img_url if img_url.startswith(('http://', 'https://'))
+            else urljoin(base_url, img_url)
+            for img_url in sources
+        ]
+
+        # Download the images and get local paths (relative to output root)
+        asset_paths = dict(zip(
+            sources, self.image_pool.map(self._download_image, absolute_urls)
+        ))
+
+        # Calculate relative path based on URL depth
+        url_path = base_url[len(self.base_url):].strip('/')
+        depth = len(url_path.split('/')) - 1 if url_path else 0
+        prefix = '../' * depth if depth > 0 else './'
+
         def replace_img(match):
-            alt_text = match.group(1)
-            img_url = match.group(2)
-            
-            # Convert relative URLs to absolute
-            if not img_url.startswith(('http://', 'https://')):
-                img_url = self.spider.normalize_url(base_url, img_url)
-                
-            # Download the image and get local path (relative to output root)
-            asset_path = self.res_handler.download_image(img_url)
-            
-            # Calculate relative path based on URL depth
-            url_path = base_url[len(self.config.get('target_url')):].strip('/')
-            depth = len(url_path.split('/')) - 1 if url_path else 0
-            prefix = '../' * depth if depth > 0 else './'
-            
-            # Construct final path
-            local_path = f"{prefix}{asset_path}"
-            
+            asset_path = asset_paths[match.group(2)]
+
+            # Failed downloads keep pointing at the original URL
+            local_path = f"{prefix}{asset_path}" if asset_path.startswith('assets/') else asset_path
+
             # Return updated markdown image syntax
-            return f'![{alt_text}]({local_path})'
-        
-        return re.sub(img_pattern, replace_img, markdown)
+            return f'![{match.group(1)}]({local_path})'
+
+        return IMAGE_PATTERN.sub(replace_img, markdown)
+
+    def _download_image(self, url):
+        """Download one image, timing it as the image stage"""
+        with self.metrics.timer('image'):
+            asset_path = self.res_handler.download_image(url)
+        self.metrics.inc('images')
+        return asset_path
+
+    def _page_path(self, url):
+        """Generate the Markdown path for a URL, relative to the output root"""
+        # Create a clean filename from URL
+        if url.startswith(self.base_url):
+            path = url[len(self.base_url):].strip('/')
+        else:
+            path = url.replace('://', '_').replace('/', '_')
+
+        # Handle empty path (homepage)
+        if not path:
+            path = "index"
+
+        return f"{path}.md"
 
     def _save_markdown(self, url, content):
-        """Generate file path based on URL and save content"""
+        """Save a page's Markdown to the output sink; returns None if its output is unchanged"""
+        path = self._page_path(url)
+        if self.manifest:
+            event, previous = self.manifest.record(url, path, content_hash(content))
+            if event == 'unchanged':
+                return None
+            if previous != path:
+                self._release_path(url, previous)
+        return self.sink.write_page(url, path, PageConverter.title_of(content), content)
+
+
+class BatchWebToMarkdown(_ConversionLoop):
+    """Mirror every site listed under ``sites`` in one process
+
+    Each entry overrides the top-level settings for its site and needs at
+    least a ``target_url``; ``output_dir`` defaults to a directory named
+    after the site's host and path, and no two sites may share one. Sites share the HTTP transport, image pool,
+    metrics and conversion workers, and one scheduler crawls them all under
+    the top-level ``concurrency`` budget. Conversion settings (engine,
+    links, tables) come from the top level because the worker pool is shared.
+    """
+
+    # Per-site state files, placed in each site's output directory
+    SITE_FILES = {
+        'cache_db': '.http_cache.sqlite',
+        'checkpoint_path': '.crawl_journal',
+        'frontier_spill_path': '.frontier.sqlite',
+        'manifest': '.manifest.sqlite',
+        'change_feed': 'changes.jsonl',
+        'capture': '.capture.sqlite',
+    }
+
+    def __init__(self, config_path="config/default.yaml", resume=False, reconvert=False):
+        self.config = ConfigLoader(config_path)
+        self.logger = Logger(__name__)
+        self.shared = _SharedResources(self.config)
+        self.metrics = self.shared.metrics
+        self.profile_rate = self.shared.profile_rate
+
+        # Sites are set up in parallel since each fetches its robots.txt
+        overrides = [self._site_overrides(site) for site in self.config.get('sites')]
+        self._check_output_dirs(overrides)
+        with ThreadPoolExecutor(max_workers=16, thread_name_prefix='setup') as setup:
+            self.sites = list(setup.map(
+                lambda site: WebToMarkdown(config_path, resume, site, self.shared, reconvert), overrides
+            ))
+
+        self.scheduler = None if reconvert else CrawlScheduler(
+            [site.spider for site in self.sites],
+            self.shared.transport,
+            self.config.get('concurrency', 16),
+            self.config.get('per_host_concurrency', 4)
+        )
+
+    def run(self):
+        """Crawl and convert every site, then close them all"""
+        sites = {site.spider: site for site in self.sites}
+        if self.scheduler:
+            pages = (
+                (sites[spider], url, html, tree)
+                for spider, (url, html, tree) in self.scheduler.crawl()
+            )
+        else:
+            # Re-conversion replays each site's capture in turn
+            pages = (
+                (site, url, html, tree)
+                for site in self.sites if site.capture
+                for url, html, tree in site.pages()
+            )
         try:
-            base_url = self.config.get('target_url')
-            # Create a clean filename from URL
-            if url.startswith(base_url):
-                path = url[len(base_url):].strip('/')
-            else:
-                path = url.replace('://', '_').replace('/', '_')
-                
-            # Handle empty path (homepage)
-            if not path:
-                path = "index"
-                
-            output_dir = Path(self.config.get('output_dir'))
-            output_path = output_dir / f"{path}.md"
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(content)
-            return output_path
-            
-        except Exception as e:
-            self.logger.error(f"Error saving markdown for {url}: {e}")
-            # Fallback to a safe filename
-            output_path = Path(self.config.get('output_dir')) / f"page_{hash(url) % 10000}.md"
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(content)
-            return output_path
+            self._convert(pages)
+            for site in self.sites:
+                site.finish_output()
+        finally:
+            for site in self.sites:
+                site.close()
+            self.shared.close(self.config)
+
+    def _site_overrides(self, site):
+        """Settings of one site, with its state files kept apart from the others"""
+        site = dict(site)
+        output_dir = Path(site.setdefault(
+            'output_dir', str(Path(self.config.get('output_dir')) / self._site_dir_name(site['target_url']))
+        ))
+        for key, name in self.SITE_FILES.items():
+            if key not in site and self.config.get(key):
+                site[key] = str(output_dir / name)
+
+        # Packed archives default to the site's own output directory
+        site.setdefault('output_path', None)
+        return site
+
+    @staticmethod
+    def _site_dir_name(target_url):
+        """Directory name for a site: its host and path, e.g. docs.python.org_zh-cn_3_library"""
+        parsed = urlparse(target_url)
+        return re.sub(r'[^\w.-]+', '_', f"{parsed.netloc}/{parsed.path.strip('/')}".strip('/'))
+
+    @staticmethod
+    def _check_output_dirs(sites):
+        """Refuse sites sharing an output directory, whose state files and pages would clash"""
+        seen = {}
+        for site in sites:
+            output_dir = Path(site['output_dir']).resolve()
+            if output_dir in seen:
+                raise ValueError(
+                    f"Sites {seen[output_dir]} and {site['target_url']} both write to {output_dir}; "
+                    "give each its own output_dir"
+                )
+            seen[output_dir] = site['target_url']
 
 
 if __name__ == '__main__':
-    WebToMarkdown().run()
+    parser = argparse.ArgumentParser(description="Convert a website to a Markdown archive")
+    parser.add_argument('--config', default="config/default.yaml", help="path to the YAML config")
+    parser.add_argument('--resume', action='store_true', help="continue an interrupted crawl from its checkpoint")
+    parser.add_argument('--reconvert', action='store_true',
+                        help="convert the pages recorded in the capture store again, without crawling")
+    parser.add_argument('--work-queue', help="join a distributed crawl through this SQLite path or redis:// URL")
+    parser.add_argument('--worker-index', type=int, help="this worker's position among the workers, from 0")
+    parser.add_argument('--worker-count', type=int, help="number of workers sharing the work queue")
+    args = parser.parse_args()
+
+    overrides = {
+        key: value for key, value in (
+            ('work_queue', args.work_queue),
+            ('worker_index', args.worker_index),
+            ('worker_count', args.worker_count),
+        ) if value is not None
+    }
+
+    # A config listing several sites mirrors them all in one process
+    if ConfigLoader(args.config).get('sites'):
+        BatchWebToMarkdown(args.config, resume=args.resume, reconvert=args.reconvert).run()
+    else:
+        WebToMarkdown(args.config, resume=args.resume, overrides=overrides, reconvert=args.reconvert).run()